@@ -0,0 +1,85 @@
+"""
+Benchmark of the SmartDownloader write path against a local HTTP server.
+
+Usage:
+    python benchmarks/bench_download.py [--size MB] [--files N] [--segments N]
+
+CPU time includes the in-process server, so compare rows with each other
+rather than with absolute numbers.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "..", "src"))
+
+from core.downloader import SmartDownloader  # noqa: E402
+from core.session import HttpSession  # noqa: E402
+from fake_server import FakeServer  # noqa: E402
+
+# (label, read_size, buffer_size)
+CONFIGS = [
+    ("8K reads, 8K writes", 8192, 8192),
+    ("64K reads, 256K writes", 65536, 256 * 1024),
+    ("socket reads, 1M writes", None, 1024 * 1024),
+    ("socket reads, 4M writes", None, 4 * 1024 * 1024),
+]
+
+
+async def run(server, read_size, buffer_size, files, segments, workdir):
+    async with HttpSession(max_per_host=files * segments) as session:
+        downloaders = [
+            SmartDownloader(
+                session,
+                os.path.join(workdir, f"f{i}"),
+                segments=segments,
+                read_size=read_size,
+                buffer_size=buffer_size,
+            )
+            for i in range(files)
+        ]
+        await asyncio.gather(
+            *(
+                d.download(f"{server.base_url}/video{i}.mp4", 1, progress=None)
+                for i, d in enumerate(downloaders)
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=200, help="File size in MB")
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--segments", type=int, default=1)
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    total = size * args.files
+    print(f"{'config':<26}{'MB/s':>10}{'CPU s/GB':>11}")
+    with FakeServer(size) as server:
+        for label, read_size, buffer_size in CONFIGS:
+            with tempfile.TemporaryDirectory() as workdir:
+                cpu = time.process_time()
+                wall = time.perf_counter()
+                asyncio.run(
+                    run(
+                        server,
+                        read_size,
+                        buffer_size,
+                        args.files,
+                        args.segments,
+                        workdir,
+                    )
+                )
+                wall = time.perf_counter() - wall
+                cpu = time.process_time() - cpu
+            print(f"{label:<26}{total / wall / 1e6:>10.1f}{cpu / (total / 1e9):>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
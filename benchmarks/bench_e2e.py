@@ -0,0 +1,161 @@
+"""
+End-to-end benchmark of the download pipeline against a local fake site.
+
+Usage:
+    python benchmarks/bench_e2e.py [--process 1,3,6] [--episodes N] [--size MB]
+        [--segments N] [--mirrors N] [--rate MB] [--latency MS]
+        [--failure-rate F]
+
+Each -p setting downloads a whole series (listing, episode pages, player
+pages, videos) in a fresh process, so CPU time and peak RSS are those of
+the downloader alone and not of the server.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "..", "src"))
+
+from rich.console import Console  # noqa: E402
+
+from core.cache import CacheStore  # noqa: E402
+from core.orchestrator import Orchestrator  # noqa: E402
+from core.progress import ProgressTracker  # noqa: E402
+from fake_server import FakeServer  # noqa: E402
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def download_series(series_url, output_dir, process, segments):
+    # No page cache so every run scrapes the same pages
+    async with Orchestrator(
+        output_dir, max_concurrent=process, segments=segments, cache=CacheStore()
+    ) as orchestrator:
+        tracker = ProgressTracker(None, Console(file=io.StringIO()))
+        return await orchestrator.download_episodes(
+            orchestrator.iter_series_episodes(series_url), tracker
+        )
+
+
+def child(config):
+    """Runs one configuration and prints its numbers as JSON."""
+    with tempfile.TemporaryDirectory() as workdir:
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        results = asyncio.run(
+            download_series(
+                config["series_url"], workdir, config["process"], config["segments"]
+            )
+        )
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+    print(
+        json.dumps(
+            {
+                "wall": wall,
+                "cpu": cpu,
+                "rss": peak_rss_mb(),
+                "done": results.count(True),
+                "failed": results.count(False),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--process", default="1,3,6", help="Comma-separated -p values to compare"
+    )
+    parser.add_argument("--episodes", type=int, default=12)
+    parser.add_argument("--size", type=int, default=10, help="Episode size in MB")
+    parser.add_argument("--segments", type=int, default=1)
+    parser.add_argument(
+        "--mirrors", type=int, default=1, help="Mirrors per episode, all raced"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=8,
+        help="Bandwidth cap per connection in MB/s (0 for none)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=20, help="Delay of every response in ms"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of video responses cut off halfway",
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(json.loads(args.child))
+        return
+
+    size = args.size * 1024 * 1024
+    total = size * args.episodes
+    rate = f"{args.rate:g} MB/s" if args.rate else "unlimited"
+    print(
+        f"{args.episodes} episodes of {args.size} MB, {rate} per connection, "
+        f"{args.latency:g} ms latency, {args.failure_rate:.0%} of bodies cut off"
+    )
+    print(
+        f"{'-p':>4}{'episodes/min':>14}{'MB/s':>9}{'CPU s/GB':>10}"
+        f"{'peak RSS MB':>13}{'failed':>8}"
+    )
+    with FakeServer(
+        size,
+        rate=args.rate * 1024 * 1024 or None,
+        episodes=args.episodes,
+        mirrors=args.mirrors,
+        latency=args.latency / 1000,
+        failure_rate=args.failure_rate,
+    ) as server:
+        for process in [int(p) for p in args.process.split(",")]:
+            config = {
+                "series_url": server.series_url,
+                "process": process,
+                "segments": args.segments,
+            }
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", json.dumps(config)],
+                stdout=subprocess.PIPE,
+                check=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            rss = "-" if result["rss"] is None else f"{result['rss']:.0f}"
+            print(
+                f"{process:>4}"
+                f"{result['done'] / result['wall'] * 60:>14.1f}"
+                f"{total / result['wall'] / 1e6:>9.1f}"
+                f"{result['cpu'] / (total / 1e9):>10.2f}"
+                f"{rss:>13}"
+                f"{result['failed']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of the HTML parser backends on saved VoirAnime pages.
+
+Usage:
+    python benchmarks/bench_parsers.py [--repeat N] [--series FILE] [--episode FILE]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "..", "src"))
+
+from extractors.parsers import available_parsers, get_parser  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, "fixtures")
+SERIES_URL = "https://v6.voiranime.com/anime/one-piece"
+
+
+def bench(func, repeat):
+    # Best of 5 runs, in milliseconds per call
+    return min(timeit.repeat(func, number=repeat, repeat=5)) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--series", default=os.path.join(FIXTURES, "voiranime_series.html")
+    )
+    parser.add_argument(
+        "--episode", default=os.path.join(FIXTURES, "voiranime_episode.html")
+    )
+    args = parser.parse_args()
+
+    with open(args.series, encoding="utf-8") as f:
+        series_html = f.read()
+    with open(args.episode, encoding="utf-8") as f:
+        episode_html = f.read()
+
+    reference = get_parser("bs4")
+    expected_links = reference.links(series_html)
+    expected_iframe = reference.player_iframe(
+        episode_html, "chapter-video-frame", "streamtape"
+    )
+
+    print(f"{'parser':<12}{'series (ms)':>14}{'episode (ms)':>15}{'speedup':>10}")
+    baseline = None
+    for name in reversed(available_parsers()):
+        backend = get_parser(name)
+
+        links = [u for u in backend.links(series_html) if u.startswith(SERIES_URL)]
+        iframe = backend.player_iframe(
+            episode_html, "chapter-video-frame", "streamtape"
+        )
+        if links != [u for u in expected_links if u.startswith(SERIES_URL)]:
+            print(f"{name}: episode links differ from bs4")
+        if iframe != expected_iframe:
+            print(f"{name}: player iframe differs from bs4 ({iframe!r})")
+
+        series_ms = bench(
+            lambda backend=backend: backend.links(series_html), args.repeat
+        )
+        episode_ms = bench(
+            lambda backend=backend: backend.player_iframe(
+                episode_html, "chapter-video-frame", "streamtape"
+            ),
+            args.repeat,
+        )
+        total = series_ms + episode_ms
+        if baseline is None:
+            baseline = total
+        print(
+            f"{name:<12}{series_ms:>14.2f}{episode_ms:>15.2f}{baseline / total:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
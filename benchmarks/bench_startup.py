@@ -0,0 +1,122 @@
+"""
+Cold start of the `vadl` entry point, from `python -X importtime`.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--top N] [--budget MS]
+        [--forbid MODULES] [-- ARGS...]
+
+Runs `src/main.py ARGS` (default: --help) in fresh interpreters and reports
+the median wall time, the median time spent importing after `site`, and the
+slowest imports by cumulative time. Exits with status 1 when the import time
+is over the budget or a forbidden module was imported, so it can be used as
+a regression check.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(ROOT, "..", "src", "main.py")
+
+# Agreed budget for the imports of `vadl --help`, in milliseconds
+DEFAULT_BUDGET_MS = 50.0
+# Modules only the commands that download should import
+DEFAULT_FORBID = "asyncio,httpx,bs4,rich"
+
+
+def parse_importtime(stderr):
+    """
+    Returns (name, depth, cumulative microseconds) for every import logged
+    after `site`, which is the interpreter's own startup.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # One space after the bar, then two per nesting level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        name = name.strip()
+        if name == "site" and depth == 0:
+            imports = []
+            continue
+        imports.append((name, depth, int(cumulative)))
+    return imports
+
+
+def run_once(args):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", MAIN] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        # Keep the user's site-packages but not their PYTHONSTARTUP and co.
+        env={k: v for k, v in os.environ.items() if not k.startswith("PYTHON")},
+    )
+    wall = time.perf_counter() - start
+    return wall, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest imports listed"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help=f"Maximum median import time in ms (default: {DEFAULT_BUDGET_MS:g})",
+    )
+    parser.add_argument(
+        "--forbid",
+        default=DEFAULT_FORBID,
+        help=f"Comma-separated modules that must not be imported (default: {DEFAULT_FORBID})",
+    )
+    parser.add_argument("args", nargs="*", help="Arguments given to vadl")
+    args = parser.parse_args()
+    vadl_args = args.args or ["--help"]
+
+    walls = []
+    totals = []
+    slowest = {}
+    imported = set()
+    for _ in range(args.runs):
+        wall, imports = run_once(vadl_args)
+        walls.append(wall)
+        totals.append(sum(us for _, depth, us in imports if depth == 0) / 1000)
+        for name, _, us in imports:
+            imported.add(name)
+            slowest.setdefault(name, []).append(us / 1000)
+
+    wall = statistics.median(walls) * 1000
+    total = statistics.median(totals)
+    print(f"vadl {' '.join(vadl_args)}: {args.runs} runs")
+    print(f"  wall time      {wall:8.1f} ms (median)")
+    print(f"  imports        {total:8.1f} ms (median, after site)")
+    print(f"\n{'cumulative ms':>14}  module")
+    medians = {name: statistics.median(times) for name, times in slowest.items()}
+    for name, ms in sorted(medians.items(), key=lambda x: -x[1])[: args.top]:
+        print(f"{ms:>14.1f}  {name}")
+
+    failures = []
+    if total > args.budget:
+        failures.append(f"imports take {total:.1f} ms, budget is {args.budget:g} ms")
+    for module in filter(None, args.forbid.split(",")):
+        if module in imported:
+            failures.append(f"{module} is imported")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"\nOK: within the {args.budget:g} ms budget")
+
+
+if __name__ == "__main__":
+    main()
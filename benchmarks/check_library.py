@@ -0,0 +1,88 @@
+"""
+Regression check of library links for post-processed videos.
+
+Usage:
+    python benchmarks/check_library.py
+
+Stores, under the direct URL of an episode of the fake site, an object whose
+size differs from the download (as `remux` or the faststart rewrite leave
+it), then downloads the episode twice. The first run must link the object
+and complete; the second must find the episode complete. Exits with status
+1 otherwise.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "..", "src"))
+
+from rich.console import Console  # noqa: E402
+
+from core.cache import CacheStore  # noqa: E402
+from core.integrity import default_algorithm, hash_file  # noqa: E402
+from core.journal import COMPLETE  # noqa: E402
+from core.library import LibraryStore  # noqa: E402
+from core.orchestrator import Orchestrator  # noqa: E402
+from core.progress import ProgressTracker  # noqa: E402
+from fake_server import FakeServer  # noqa: E402
+
+SIZE = 256 * 1024
+# Bytes the fake post-processing step took off the download
+SHRINK = 1000
+
+
+async def download(server, library_dir, output_dir):
+    async with Orchestrator(
+        output_dir, cache=CacheStore(), library=LibraryStore(library_dir)
+    ) as orchestrator:
+        tracker = ProgressTracker(None, Console(file=io.StringIO()))
+        episodes = await orchestrator.get_series_episodes(server.series_url)
+        results = await orchestrator.download_episodes(episodes, tracker)
+        entry = orchestrator._journal(episodes[0]).get(episodes[0].number)
+        return results, entry
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir, FakeServer(
+        SIZE, episodes=1
+    ) as server:
+        library_dir = os.path.join(workdir, "library")
+        processed = os.path.join(workdir, "processed.mp4")
+        with open(processed, "wb") as f:
+            f.write(server.body[: SIZE - SHRINK])
+        algorithm = default_algorithm()
+        library = LibraryStore(library_dir)
+        library.add(
+            processed,
+            [f"{server.base_url}/video/1.mp4"],
+            hash_file(processed, algorithm),
+            algorithm,
+            source_size=SIZE,
+        )
+        library.close()
+
+        output_dir = os.path.join(workdir, "out")
+        for run in (1, 2):
+            results, entry = asyncio.run(download(server, library_dir, output_dir))
+            state = entry["state"] if entry else None
+            size = entry["size"] if entry else None
+            print(f"run {run}: results {results}, journal {state} ({size} bytes)")
+            if results != [True] or state != COMPLETE or size != SIZE - SHRINK:
+                failures.append(run)
+        if server.stats.get("body"):
+            failures.append("body")
+            print(f"{server.stats['body']} video bodies were requested")
+
+    if failures:
+        print("FAIL: the linked library object was not recorded as complete")
+        sys.exit(1)
+    print("OK: the post-processed object was linked and recorded")
+
+
+if __name__ == "__main__":
+    main()
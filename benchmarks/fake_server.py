@@ -0,0 +1,227 @@
+"""
+Local stand-in for VoirAnime and the video host, used by the benchmarks.
+
+Serves an in-memory body of a given size with HEAD, Range requests and an
+optional per-connection bandwidth cap. It also serves a VoirAnime-like
+series page (`series_url`) and episode pages listing `mirrors` hosts in
+a host select, each player being a Streamtape-like page with the botlink
+obfuscation. The player redirects to
+`/video/<n>.mp4`, and any other path returns the body too.
+
+Every response can be delayed by `latency` seconds. A `failure_rate`
+fraction of body responses is cut off halfway to exercise retries and
+resume.
+"""
+
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+SLUG = "bench"
+
+
+class FakeServer:
+    def __init__(
+        self,
+        size: int,
+        rate: Optional[float] = None,
+        port: int = 0,
+        episodes: int = 12,
+        mirrors: int = 1,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.body = bytes(range(256)) * (size // 256) + bytes(size % 256)
+        # Bytes per second per connection, None for unlimited
+        self.rate = rate
+        self.episodes = episodes
+        self.mirrors = mirrors
+        self.latency = latency
+        self.failure_rate = failure_rate
+        # Requests served by kind (series, episode, player, redirect, head,
+        # body) and bodies cut off on purpose (failure)
+        self.stats: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def series_url(self) -> str:
+        return f"{self.base_url}/anime/{SLUG}/"
+
+    def start(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.stats[kind] = self.stats.get(kind, 0) + 1
+
+    def _should_fail(self) -> bool:
+        if not self.failure_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def series_page(self) -> str:
+        links = "".join(
+            f'<li><a href="{self.base_url}/anime/{SLUG}/{SLUG}-{n}-vostfr/">'
+            f"Episode {n}</a></li>"
+            for n in range(self.episodes, 0, -1)
+        )
+        return f'<html><body><ul class="listing">{links}</ul></body></html>'
+
+    def episode_page(self, number: int, host: str = "") -> str:
+        """
+        The page as VoirAnime serves it: a host select whose options lead to
+        the page of each host (`?host=LECTEUR X`), and the iframe of the host
+        asked for (by default the first one). "LECTEUR MOON" has no
+        registered player.
+        """
+        page_url = f"{self.base_url}/anime/{SLUG}/{SLUG}-{number}-vostfr/"
+        labels = ["LECTEUR Stape"] + [
+            f"LECTEUR Stape {mirror + 1}" for mirror in range(1, self.mirrors)
+        ]
+        options = "".join(
+            f'<option class="short" data-redirect="{page_url}?host={quote(label)}" '
+            f'value="{label}">{label}</option>'
+            for label in labels + ["LECTEUR MOON"]
+        )
+        mirror = labels.index(host) if host in labels else 0
+        player = f"{self.base_url}/streamtape/e/{number}"
+        if mirror:
+            player += f"?m={mirror}"
+        return (
+            '<html><body><div class="select-view"><select class="host-select">'
+            f"{options}</select></div>"
+            f'<div id="chapter-video-frame"><iframe src="{player}"></iframe></div>'
+            "</body></html>"
+        )
+
+    def player_page(self, number: int, query: str) -> str:
+        # The token is only usable after dropping its first 4 characters
+        return (
+            "<html><body><script>document.getElementById('botlink').innerHTML = "
+            f"'{self.base_url}/get_video?id={number}{query}&token=' + "
+            f"('xcvbtok{number}').substring(4);</script></body></html>"
+        )
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_html(self, html):
+                data = html.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_body_headers(self, status, length, extra=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(length))
+                self.send_header("Accept-Ranges", "bytes")
+                for key, value in (extra or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+
+            def do_HEAD(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                server._count("head")
+                self._send_body_headers(200, len(server.body))
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                path = self.path
+                if path.rstrip("/") == f"/anime/{SLUG}":
+                    server._count("series")
+                    return self._send_html(server.series_page())
+                match = re.match(rf"/anime/{SLUG}/{SLUG}-(\d+)-", path)
+                if match:
+                    server._count("episode")
+                    host = parse_qs(urlparse(path).query).get("host", [""])[0]
+                    return self._send_html(
+                        server.episode_page(int(match.group(1)), host)
+                    )
+                match = re.match(r"/streamtape/e/(\d+)(?:\?m=(\d+))?", path)
+                if match:
+                    server._count("player")
+                    query = f"&m={match.group(2)}" if match.group(2) else ""
+                    return self._send_html(
+                        server.player_page(int(match.group(1)), query)
+                    )
+                match = re.match(r"/get_video\?id=(\d+)", path)
+                if match:
+                    server._count("redirect")
+                    self.send_response(302)
+                    self.send_header(
+                        "Location", f"{server.base_url}/video/{match.group(1)}.mp4"
+                    )
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self._send_video()
+
+            def _send_video(self):
+                server._count("body")
+                body = server.body
+                start, end = 0, len(body) - 1
+                match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if match:
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), end)
+                    self._send_body_headers(
+                        206,
+                        end - start + 1,
+                        {"Content-Range": f"bytes {start}-{end}/{len(body)}"},
+                    )
+                else:
+                    self._send_body_headers(200, len(body))
+
+                view = memoryview(body)[start : end + 1]
+                if server._should_fail():
+                    # Send half the body, then drop the connection
+                    server._count("failure")
+                    view = view[: len(view) // 2]
+                    self.close_connection = True
+                step = 256 * 1024
+                try:
+                    for offset in range(0, len(view), step):
+                        self.wfile.write(view[offset : offset + step])
+                        if server.rate:
+                            time.sleep(step / server.rate)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
@@ -1,31 +1,49 @@
 import argparse
 import logging
-import asyncio
-from rich.console import Console
-from rich.logging import RichHandler
-from rich.prompt import Prompt
-from rich.progress import (
-    Progress,
-    SpinnerColumn,
-    BarColumn,
-    TextColumn,
-    DownloadColumn,
-    TransferSpeedColumn,
-    TimeRemainingColumn,
-)
+import os
+import sys
+import time
+from contextlib import nullcontext
 
-from utils import sanitize_filename
-from core.orchestrator import Orchestrator
-from core.config import SupportedPlayers
-from extractors.platforms.voiranime import VoirAnimeEpisode
+# Only light modules are imported here so that --help and argument errors
+# answer at once. httpx, BeautifulSoup and rich are imported by the
+# commands that use them.
+from utils import (
+    format_episodes,
+    in_ranges,
+    parse_duration,
+    parse_episodes,
+    parse_rate,
+    parse_size,
+    sanitize_filename,
+)
+from core.config import (
+    DEFAULT_HOST,
+    DEFAULT_POLL_INTERVAL,
+    DEFAULT_PORT,
+    DOWNLOAD_ORDERS,
+    PARSER_NAMES,
+    SupportedPlayers,
+)
 
 
 class AnimeDL:
     def __init__(self):
-        self.console = Console()
+        self._console = None
         self.logger = logging.getLogger(__name__)
+        self.quiet = False
+
+    @property
+    def console(self):
+        if self._console is None:
+            from rich.console import Console
+
+            self._console = Console()
+        return self._console
 
     def _setup_logging(self, debug_mode):
+        from rich.logging import RichHandler
+
         level = logging.DEBUG if debug_mode else logging.INFO
         logging.basicConfig(
             level=level,
@@ -42,6 +60,7 @@ class AnimeDL:
             # Ensure orchestrator and downloader don't spam INFO logs during progress
             logging.getLogger("core.orchestrator").setLevel(logging.WARNING)
             logging.getLogger("core.downloader").setLevel(logging.WARNING)
+            logging.getLogger("core.session").setLevel(logging.WARNING)
 
     def _get_output_dir(self, args_output, series_name):
         if args_output:
@@ -52,6 +71,8 @@ class AnimeDL:
         if args_start is not None:
             return args_start
 
+        from rich.prompt import Prompt
+
         try:
             val = Prompt.ask(
                 "Start download from episode",
@@ -63,104 +84,432 @@ class AnimeDL:
             self.console.print("[yellow]Invalid number. Starting from first.[/]")
             return first_ep
 
+    def _make_cache(self, args):
+        from core.cache import CacheStore
+
+        if args.no_cache:
+            return CacheStore()
+        return CacheStore.default(refresh=args.refresh)
+
+    def _make_library(self, args):
+        from core.library import LibraryStore
+
+        return LibraryStore(args.library)
+
+    def _make_postprocessor(self, args):
+        if not args.postprocess:
+            return None
+        from core.postprocess import PostProcessor
+
+        return PostProcessor(args.postprocess, args.postprocess_jobs)
+
+    def _make_progress(self):
+        from core.progress import ProgressTracker, make_progress
+
+        # Counters are still kept in quiet mode, they are just never drawn
+        progress = None if self.quiet else make_progress(self.console)
+        return ProgressTracker(progress, self.console)
+
+    def _status(self, message):
+        if self.quiet:
+            return nullcontext()
+        return self.console.status(message)
+
+    def _make_orchestrator(self, args, output_dir, max_concurrent):
+        from core.orchestrator import Orchestrator
+
+        orchestrator = Orchestrator(
+            output_dir=output_dir,
+            max_concurrent=max_concurrent,
+            player_code=args.player,
+            segments=args.segments,
+            max_resolvers=args.resolvers,
+            cache=self._make_cache(args),
+            parser=args.parser,
+            max_per_host=args.per_host,
+            adaptive=args.adaptive,
+            max_limit=args.max_process,
+            limit_rate=args.limit_rate,
+            episode_rate=args.limit_rate_episode,
+            rate_schedule=args.rate_schedule,
+            read_size=args.read_size,
+            buffer_size=args.buffer_size,
+            journal=not args.no_journal,
+            checksum=not args.no_checksum,
+            race=not args.no_race,
+            library=self._make_library(args),
+            postprocessor=self._make_postprocessor(args),
+            order=args.order,
+            prefetch=args.prefetch,
+        )
+        for ranges in args.boost or []:
+            orchestrator.boost(ranges)
+        return orchestrator
+
+    def _selected(self, episode, start, args):
+        """Whether an episode is after the start episode and in --episodes."""
+        if start is not None and episode.number < start:
+            return False
+        return args.episodes is None or in_ranges(episode.number, args.episodes)
+
+    def _make_episode(self, url, args, orchestrator):
+        return orchestrator.platform.episode_from_url(url)
+
     async def _handle_series(self, url, args):
         # Initialize Orchestrator with temporary output dir (will be updated)
         # We need to fetch episodes first to know the series name or just use URL
-        orchestrator = Orchestrator(
-            output_dir=".", max_concurrent=args.process, player_code=args.player
-        )
+        async with self._make_orchestrator(args, ".", args.process) as orchestrator:
+            # Episodes are streamed from the listing, downloads start as soon
+            # as the first page is parsed
+            episodes = orchestrator.iter_series_episodes(url)
+            with self._status("[bold]Fetching episodes...[/]"):
+                try:
+                    first = await episodes.__anext__()
+                except StopAsyncIteration:
+                    first = None
+            if first is None:
+                self.console.print("[red]No episodes found.[/]")
+                return
+
+            self.console.print(f"Found episodes (First: {first.number})")
+
+            # An explicit selection needs no start episode
+            start_ep = args.start
+            if args.episodes is None:
+                start_ep = self._resolve_start_episode(first.number, args.start)
+
+            async def to_download():
+                if self._selected(first, start_ep, args):
+                    yield first
+                async for ep in episodes:
+                    if self._selected(ep, start_ep, args):
+                        yield ep
+
+            series_name = args.output or url.rstrip("/").split("/")[-1] or "Anime"
+            output_dir = self._get_output_dir(args.output, series_name)
+
+            # Update orchestrator output dir
+            orchestrator.output_dir = output_dir
+
+            if args.episodes is not None:
+                selection = f"episodes {format_episodes(args.episodes)}"
+                if start_ep is not None:
+                    selection += f" from episode {start_ep}"
+            else:
+                selection = f"from episode {start_ep}"
+            self.console.print(
+                f"[bold]Downloading {selection} (Player: {args.player}).[/]"
+            )
+
+            with self._make_progress() as progress:
+                results = await orchestrator.download_episodes(to_download(), progress)
 
-        fetch_status = self.console.status("[bold]Fetching episodes...[/]")
-        fetch_status.start()
-        episodes = await orchestrator.get_series_episodes(url)
-        if not episodes:
-            self.console.print("[red]No episodes found.[/]")
+            failed = results.count(False)
+            self.console.print(
+                f"[bold]Finished {len(results)} episodes: {len(results) - failed} done, {failed} failed.[/]"
+            )
+
+    async def _handle_single_episode(self, url, args):
+        self.console.print("[bold]Detected single episode.[/]")
+
+        async with self._make_orchestrator(args, args.output or ".", 1) as orchestrator:
+            episode = self._make_episode(url, args, orchestrator)
+
+            # We need a progress context even for single download to show bars
+            with self._make_progress() as progress:
+                await orchestrator.download_episode(episode, progress)
+
+    def _read_batch(self, source):
+        """
+        Reads "URL [START]" lines from a file, or stdin for "-".
+        Blank lines and lines starting with # are ignored.
+        """
+        if source == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(source, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+
+        entries = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            start = None
+            if len(parts) > 1 and parts[1].isdigit():
+                start = int(parts[1])
+            entries.append((parts[0], start))
+        return entries
+
+    async def _handle_batch(self, source, args):
+        entries = self._read_batch(source)
+        if not entries:
+            self.console.print("[red]No URLs found in batch file.[/]")
             return
 
-        fetch_status.stop()
+        import asyncio
 
-        first, last = episodes[0].number, episodes[-1].number
-        self.console.print(
-            f"Found {len(episodes)} episodes (First: {first}, Last: {last})"
+        async with self._make_orchestrator(
+            args, args.output or ".", args.process
+        ) as orchestrator:
+            with self._status(f"[bold]Fetching episodes for {len(entries)} URLs...[/]"):
+                listings = await asyncio.gather(
+                    *(orchestrator.get_series_episodes(url) for url, _ in entries)
+                )
+
+            groups = []
+            for (url, start), episodes in zip(entries, listings):
+                series_name = url.rstrip("/").split("/")[-1] or "Anime"
+                if episodes:
+                    # A series page: episodes land in a folder named after the series
+                    start = start if start is not None else args.start
+                    episodes = [
+                        ep for ep in episodes if self._selected(ep, start, args)
+                    ]
+                    folder = sanitize_filename(series_name)
+                else:
+                    # No listing found, treat the URL as a single episode page
+                    episodes = [self._make_episode(url, args, orchestrator)]
+                    folder = sanitize_filename(
+                        url.rstrip("/").split("/")[-2] or series_name
+                    )
+
+                output_dir = folder
+                if args.output:
+                    output_dir = os.path.join(args.output, folder)
+                for ep in episodes:
+                    ep.output_dir = output_dir
+                    ep.name = f"{folder} {ep.name}"
+                groups.append(episodes)
+
+            total = sum(len(g) for g in groups)
+            self.console.print(
+                f"[bold]Queued {total} episodes from {len(groups)} URLs (Player: {args.player}).[/]"
+            )
+
+            with self._make_progress() as progress:
+                results = await orchestrator.download_batch(groups, progress)
+
+            failed = results.count(False)
+            self.console.print(
+                f"[bold]Batch finished: {total - failed} done, {failed} failed.[/]"
+            )
+
+    def _verify(self, argv):
+        parser = argparse.ArgumentParser(
+            prog="anime-dl verify",
+            description="Re-check downloaded files against their manifest",
+        )
+        parser.add_argument(
+            "paths", nargs="*", default=["."], help="Series or library folders"
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="Number of files hashed in parallel (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--update",
+            action="store_true",
+            help="Hash and record videos missing from the manifests",
+        )
+        args = parser.parse_args(argv)
 
-        start_ep = self._resolve_start_episode(first, args.start)
-        to_download = [ep for ep in episodes if ep.number >= start_ep]
+        from core.integrity import find_manifests, verify_manifests
 
-        series_name = args.output or url.rstrip("/").split("/")[-1] or "Anime"
-        output_dir = self._get_output_dir(args.output, series_name)
+        manifests = find_manifests(args.paths, include_unlisted=args.update)
+        if not manifests:
+            self.console.print("[red]No manifest found.[/]")
+            sys.exit(1)
 
-        # Update orchestrator output dir
-        orchestrator.output_dir = output_dir
+        styles = {
+            "ok": "green",
+            "added": "cyan",
+            "rehashed": "cyan",
+            "skipped": "yellow",
+        }
+        failed = 0
+        checked = 0
+        with self._status(f"[bold]Verifying {len(manifests)} folders...[/]"):
+            for path, status in verify_manifests(manifests, args.jobs, args.update):
+                checked += 1
+                if status not in styles:
+                    failed += 1
+                style = styles.get(status, "red")
+                self.console.print(f"[{style}]{status:>13}[/] {path}")
 
         self.console.print(
-            f"[bold]Queued {len(to_download)} episodes (Player: {args.player}).[/]"
+            f"[bold]Verified {checked} files: {checked - failed} good, {failed} bad.[/]"
         )
+        if failed:
+            sys.exit(1)
 
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("{task.description}"),
-            BarColumn(),
-            DownloadColumn(),
-            TransferSpeedColumn(),
-            TimeRemainingColumn(),
-            console=self.console,
-        ) as progress:
-            tasks = [orchestrator.download_episode(ep, progress) for ep in to_download]
-            await asyncio.gather(*tasks)
-
-    async def _handle_single_episode(self, url, args):
-        self.console.print("[bold]Detected single episode.[/]")
-        ep_num = 0
+    def _parse_address(self, value, option):
+        host, _, port = value.rpartition(":")
         try:
-            parts = url.rstrip("/").split("-")
-            for p in reversed(parts):
-                if p.isdigit():
-                    ep_num = int(p)
-                    break
+            return host or DEFAULT_HOST, int(port)
         except ValueError:
-            pass
-
-        # We construct the URL with the correct host based on player preference
-        full_url = url
-        host_param = ""
-        if args.player == SupportedPlayers.STREAMTAPE:
-            host_param = "host=LECTEUR%20Stape"
-
-        if host_param:
-            separator = "&" if "?" in url else "?"
-            full_url = f"{url}{separator}{host_param}"
-
-        episode = VoirAnimeEpisode(
-            number=ep_num,
-            name=f"Episode {ep_num}",
-            url=full_url,
-            player_code=args.player,
+            self.console.print(f"[red]Invalid {option} address: {value}[/]")
+            sys.exit(2)
+
+    async def _handle_daemon(self, args):
+        from core.daemon import Daemon
+
+        host, port = self._parse_address(args.listen, "--listen")
+
+        async with self._make_orchestrator(
+            args, args.output or ".", args.process
+        ) as orchestrator:
+            daemon = Daemon(
+                orchestrator,
+                output_dir=args.output or ".",
+                host=host,
+                port=port,
+                token=args.token,
+            )
+            # URLs given on the command line are the first jobs
+            entries = self._read_batch(args.batch) if args.batch else []
+            if args.url:
+                entries.insert(0, (args.url, None))
+            for url, start in entries:
+                daemon.enqueue(
+                    url,
+                    start=start if start is not None else args.start,
+                    select=args.episodes,
+                )
+
+            self.console.print(
+                f"[bold]Daemon listening on http://{daemon.host}:{daemon.port} (Player: {args.player}).[/]"
+            )
+            await daemon.serve_forever()
+
+    async def _add_subscription(self, args):
+        if not args.url:
+            self.console.print("[red]A series URL is required.[/]")
+            sys.exit(2)
+
+        if args.start is not None:
+            last = args.start - 1
+        else:
+            # Only episodes aired from now on will be downloaded
+            async with self._make_orchestrator(args, ".", 1) as orchestrator:
+                with self._status("[bold]Fetching episodes...[/]"):
+                    episodes = await orchestrator.get_series_episodes(args.url, ttl=0)
+            if not episodes:
+                # An empty listing is also what a failed fetch returns
+                self.console.print(
+                    "[red]No episodes found, give the first episode to "
+                    "download with --start.[/]"
+                )
+                sys.exit(1)
+            last = max(ep.number for ep in episodes)
+
+        from core.subscriptions import SubscriptionStore
+
+        store = SubscriptionStore.default()
+        try:
+            store.add(args.url, args.output, last, args.interval)
+        finally:
+            store.close()
+        self.console.print(f"[green]✔[/] Watching {args.url} (episodes after {last}).")
+
+    def _manage_subscriptions(self, argv):
+        parser = argparse.ArgumentParser(
+            prog="anime-dl watch", description="Manage followed series"
         )
+        commands = parser.add_subparsers(dest="command", required=True)
+        commands.add_parser("list", help="List followed series")
+        remove = commands.add_parser("remove", help="Stop following a series")
+        remove.add_argument("url", help="URL given to 'watch add'")
+        args = parser.parse_args(argv)
 
-        orchestrator = Orchestrator(
-            output_dir=args.output or ".", max_concurrent=1, player_code=args.player
-        )
-
-        # We need a progress context even for single download to show bars
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("{task.description}"),
-            BarColumn(),
-            DownloadColumn(),
-            TransferSpeedColumn(),
-            TimeRemainingColumn(),
-            console=self.console,
-        ) as progress:
-            await orchestrator.download_episode(episode, progress)
-
-    async def run(self):
+        from core.subscriptions import SubscriptionStore
+
+        store = SubscriptionStore.default()
+        try:
+            if args.command == "remove":
+                if not store.remove(args.url):
+                    self.console.print(f"[red]Not watching {args.url}.[/]")
+                    sys.exit(1)
+                self.console.print(f"[green]✔[/] Stopped watching {args.url}.")
+                return
+
+            subscriptions = store.all()
+            if not subscriptions:
+                self.console.print(
+                    "No series watched, add one with: vadl watch add URL"
+                )
+            for sub in subscriptions:
+                last = "-" if sub["last_episode"] is None else sub["last_episode"]
+                next_poll = time.strftime(
+                    "%Y-%m-%d %H:%M", time.localtime(sub["next_poll"])
+                )
+                self.console.print(
+                    f"{sub['url']}  last: {last}  every {sub['interval'] / 60:.0f} min  next: {next_poll}"
+                )
+        finally:
+            store.close()
+
+    async def _handle_watch(self, args):
+        from core.subscriptions import SubscriptionStore, Watcher
+
+        store = SubscriptionStore.default()
+        if not store.all():
+            self.console.print(
+                "[red]No series watched, add one with: vadl watch add URL[/]"
+            )
+            store.close()
+            return
+
+        output_dir = args.output or "."
+        try:
+            async with self._make_orchestrator(
+                args, output_dir, args.process
+            ) as orchestrator:
+                watcher = Watcher(orchestrator, store, output_dir=output_dir)
+                self.console.print(
+                    f"[bold]Watching {len(store.all())} series (Player: {args.player}).[/]"
+                )
+                with self._make_progress() as progress:
+                    await watcher.run(progress, once=args.once)
+        finally:
+            store.close()
+
+    def _make_parser(self, prog="anime-dl"):
         parser = argparse.ArgumentParser(
-            prog="anime-dl", description="VoirAnime Downloader CLI"
+            prog=prog, description="VoirAnime Downloader CLI"
+        )
+        parser.add_argument("url", nargs="?", help="URL to anime page")
+        parser.add_argument(
+            "-b",
+            "--batch",
+            metavar="FILE",
+            help="File with one series/episode URL per line ('-' for stdin)",
         )
-        parser.add_argument("url", help="URL to anime page")
         parser.add_argument("-o", "--output", help="Output directory")
         parser.add_argument("-s", "--start", type=int, help="Start episode")
+        parser.add_argument(
+            "-e",
+            "--episodes",
+            type=parse_episodes,
+            metavar="RANGES",
+            help="Episodes to download, e.g. 3-7,12 or 20- (replaces the start prompt)",
+        )
+        parser.add_argument(
+            "--order",
+            choices=DOWNLOAD_ORDERS,
+            default=DOWNLOAD_ORDERS[0],
+            help="Which episode starts and gets the bandwidth first: listing order, lowest number or fewest bytes left (default: fifo)",
+        )
+        parser.add_argument(
+            "--boost",
+            type=parse_episodes,
+            action="append",
+            metavar="RANGES",
+            help="Episodes put ahead of all others, e.g. 12 or 1-3 (repeatable)",
+        )
         parser.add_argument(
             "-p",
             "--process",
@@ -168,23 +517,262 @@ class AnimeDL:
             default=3,
             help="Number of simultaneous downloads",
         )
+        parser.add_argument(
+            "-n",
+            "--segments",
+            type=int,
+            default=1,
+            help="Number of parallel connections (byte ranges) per episode",
+        )
+        parser.add_argument(
+            "-r",
+            "--resolvers",
+            type=int,
+            help="Number of episode pages scraped simultaneously (default: same as -p)",
+        )
+        parser.add_argument(
+            "--prefetch",
+            action="store_true",
+            help="Get the next episode ready (fresh URL, HEAD, warm connection) while a download ends",
+        )
+        parser.add_argument(
+            "--adaptive",
+            action="store_true",
+            help="Tune the number of simultaneous downloads from measured throughput",
+        )
+        parser.add_argument(
+            "--max-process",
+            type=int,
+            default=16,
+            help="Upper bound for --adaptive (default: 16)",
+        )
+        parser.add_argument(
+            "--limit-rate",
+            type=parse_rate,
+            metavar="RATE",
+            help="Total bandwidth for all downloads, e.g. 800K or 2M (bytes/s)",
+        )
+        parser.add_argument(
+            "--limit-rate-episode",
+            type=parse_rate,
+            metavar="RATE",
+            help="Bandwidth cap for each episode",
+        )
+        parser.add_argument(
+            "--rate-schedule",
+            metavar="FILE",
+            help="File of 'HH:MM RATE' lines changing --limit-rate during the day",
+        )
+        parser.add_argument(
+            "--read-size",
+            type=parse_size,
+            metavar="SIZE",
+            help="Size of the chunks read from the network (default: as they arrive)",
+        )
+        parser.add_argument(
+            "--buffer-size",
+            type=parse_size,
+            default="1M",
+            metavar="SIZE",
+            help="Size of the batches written to disk (default: 1M)",
+        )
+        parser.add_argument(
+            "--per-host",
+            type=int,
+            help="Maximum simultaneous connections to a single host",
+        )
         parser.add_argument(
             "--player",
             type=str,
             default=SupportedPlayers.STREAMTAPE.value,
-            choices=[p.value for p in SupportedPlayers],
-            help="Video player to use (default: streamtape)",
+            help="Preferred video player (default: streamtape)",
+        )
+        parser.add_argument(
+            "--no-race",
+            action="store_true",
+            help="Only use the preferred player instead of racing every mirror",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Do not read or write the episode/player page cache",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Ignore cached pages and scrape everything again",
+        )
+        parser.add_argument(
+            "--no-journal",
+            action="store_true",
+            help="Do not keep a job journal in the output directory",
+        )
+        parser.add_argument(
+            "--no-checksum",
+            action="store_true",
+            help="Do not hash downloads into the folder manifest",
+        )
+        parser.add_argument(
+            "--library",
+            metavar="DIR",
+            help="Content-addressed store shared by all folders; episodes already in it are hardlinked instead of downloaded",
+        )
+        parser.add_argument(
+            "--postprocess",
+            metavar="STEPS",
+            help="Comma-separated steps run on each finished episode: faststart, remux, thumbnail (the last two need ffmpeg)",
+        )
+        parser.add_argument(
+            "--postprocess-jobs",
+            type=int,
+            default=2,
+            metavar="N",
+            help="Number of processes running post-processing steps (default: 2)",
+        )
+        parser.add_argument(
+            "--parser",
+            default="auto",
+            choices=("auto",) + PARSER_NAMES,
+            help="HTML parser backend (default: fastest installed)",
+        )
+        parser.add_argument(
+            "-q",
+            "--quiet",
+            "--no-progress",
+            dest="quiet",
+            action="store_true",
+            help="Do not draw progress bars or status spinners",
         )
         parser.add_argument(
             "--debug",
             action="store_true",
             help="Enable debug logs",
         )
+        parser.add_argument(
+            "--metrics-file",
+            metavar="FILE",
+            help="Append a JSON snapshot of the metrics to FILE every 10s and at exit",
+        )
+        parser.add_argument(
+            "--metrics-listen",
+            metavar="HOST:PORT",
+            help="Serve Prometheus metrics on this address",
+        )
+        return parser
+
+    def parse_args(self):
+        """
+        Parses the command line into (command, args). Commands that need no
+        event loop (verify, watch list/remove) run here and return None.
+        """
+        command = sys.argv[1:2]
+        if command == ["verify"]:
+            self._verify(sys.argv[2:])
+            return None
+        if command == ["watch"] and sys.argv[2:3] in (["remove"], ["list"]):
+            self._manage_subscriptions(sys.argv[2:])
+            return None
+
+        parser = self._make_parser()
+        if command == ["daemon"]:
+            # "daemon" takes the download options and serves jobs over HTTP
+            parser.prog = "anime-dl daemon"
+            parser.add_argument(
+                "--listen",
+                default=f"{DEFAULT_HOST}:{DEFAULT_PORT}",
+                metavar="HOST:PORT",
+                help=f"Address of the daemon API (default: {DEFAULT_HOST}:{DEFAULT_PORT})",
+            )
+            parser.add_argument(
+                "--token",
+                help="Bearer token required by every daemon API request",
+            )
+        elif command == ["watch"] and sys.argv[2:3] == ["add"]:
+            parser.prog = "anime-dl watch add"
+            parser.add_argument(
+                "--interval",
+                type=parse_duration,
+                default=DEFAULT_POLL_INTERVAL,
+                metavar="DURATION",
+                help="Time between two polls of the series, e.g. 30m or 6h (default: 1h)",
+            )
+            command = sys.argv[1:3]
+        elif command == ["watch"]:
+            # "watch" takes the download options and polls subscriptions
+            parser.prog = "anime-dl watch"
+            parser.add_argument(
+                "--once",
+                action="store_true",
+                help="Check every subscription once and exit (e.g. from cron)",
+            )
+        else:
+            command = []
 
-        args = parser.parse_args()
+        args = parser.parse_args(sys.argv[1 + len(command) :])
+        if not command and not args.url and not args.batch:
+            parser.error("a URL or --batch FILE is required")
+
+        # Checked after parsing: listing players loads the plugins and the
+        # parser backends import their libraries
+        from extractors.parsers import get_parser
+        from extractors.players.registry import available_players
+
+        players = available_players()
+        if args.player not in players:
+            parser.error(
+                f"argument --player: invalid choice: '{args.player}' (choose from {', '.join(players)})"
+            )
+        try:
+            args.parser = get_parser(args.parser)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.postprocess:
+            from core.postprocess import check_steps
+
+            steps = [step.strip() for step in args.postprocess.split(",")]
+            try:
+                args.postprocess = check_steps([step for step in steps if step])
+            except ValueError as e:
+                parser.error(f"argument --postprocess: {e}")
+        return command, args
+
+    async def run(self, parsed=None):
+        import asyncio
+
+        if parsed is None:
+            parsed = self.parse_args()
+            if parsed is None:
+                return
+        command, args = parsed
         self._setup_logging(args.debug)
+        self.quiet = args.quiet
 
+        from core.metrics import JsonLinesExporter, MetricsServer
+
+        exporters = []
+        if args.metrics_file:
+            exporters.append(JsonLinesExporter(args.metrics_file))
+        if args.metrics_listen:
+            exporters.append(
+                MetricsServer(
+                    *self._parse_address(args.metrics_listen, "--metrics-listen")
+                )
+            )
         try:
+            for exporter in exporters:
+                await exporter.start()
+            if command == ["daemon"]:
+                await self._handle_daemon(args)
+                return
+            if command == ["watch", "add"]:
+                await self._add_subscription(args)
+                return
+            if command == ["watch"]:
+                await self._handle_watch(args)
+                return
+            if args.batch:
+                await self._handle_batch(args.batch, args)
+                return
             try:
                 await self._handle_series(args.url, args)
             except Exception as e:
@@ -192,3 +780,6 @@ class AnimeDL:
                 await self._handle_single_episode(args.url, args)
         except (KeyboardInterrupt, asyncio.CancelledError):
             self.console.print("\n[red]Cancelled by user.[/]")
+        finally:
+            for exporter in exporters:
+                await exporter.stop()
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """
+    True for errors that mean the remote side is overloaded: 429, 5xx and timeouts.
+    """
+    if isinstance(error, httpx.TimeoutException):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limit that tunes itself with AIMD.
+
+    Downloads report the bytes they receive and the errors they hit. Every
+    `interval` seconds the controller compares the total throughput with the
+    previous window: it adds one slot while throughput keeps improving and all
+    slots are busy, takes the last slot back when an increase did not help,
+    and halves the limit on 429/5xx responses or timeouts.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int = 16,
+        interval: float = 5.0,
+        threshold: float = 0.05,
+    ):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.limit = max(minimum, min(initial, self.maximum))
+        self.interval = interval
+        # Relative throughput gain needed to count as an improvement
+        self.threshold = threshold
+        self.active = 0
+        self.reason = "initial"
+
+        self._cond = asyncio.Condition()
+        self._bytes = 0
+        self._errors = 0
+        self._last_error: Optional[BaseException] = None
+        self._last_throughput = 0.0
+        self._increased = False
+        self._task: Optional[asyncio.Task] = None
+        self._progress = None
+        self._transfer = None
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def add_bytes(self, size: int):
+        self._bytes += size
+
+    def record_error(self, error: BaseException):
+        if is_overload_error(error):
+            self._errors += 1
+            self._last_error = error
+
+    def start(self, progress=None):
+        """Starts the controller loop, showing its state in `progress` if given."""
+        self._progress = progress
+        if progress:
+            self._transfer = progress.add(self._describe())
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._progress:
+            self._progress.remove(self._transfer)
+            self._progress = None
+
+    def _describe(self) -> str:
+        return f"[cyan]Concurrency {self.active}/{self.limit} ({self.reason})"
+
+    async def _run(self):
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            received, self._bytes = self._bytes, 0
+            await self._adjust(received / (now - last))
+            last = now
+            if self._progress:
+                self._transfer.description = self._describe()
+                self._transfer.completed += received
+
+    async def _adjust(self, throughput: float):
+        if self._errors:
+            reason = f"backoff after {self._errors} errors ({self._last_error})"
+            self._errors = 0
+            self._increased = False
+            self._last_throughput = 0.0
+            await self._set_limit(max(self.minimum, self.limit // 2), reason)
+            return
+
+        improved = throughput > self._last_throughput * (1 + self.threshold)
+        if self._increased and not improved:
+            # The extra slot did not help, give it back and hold
+            self._increased = False
+            await self._set_limit(
+                self.limit - 1, f"flat throughput {throughput / 1e6:.1f} MB/s"
+            )
+        elif improved and self.active >= self.limit and self.limit < self.maximum:
+            self._increased = True
+            await self._set_limit(
+                self.limit + 1, f"throughput up {throughput / 1e6:.1f} MB/s"
+            )
+        else:
+            self._increased = False
+        self._last_throughput = throughput
+
+    async def _set_limit(self, limit: int, reason: str):
+        limit = max(self.minimum, min(limit, self.maximum))
+        if limit != self.limit:
+            logger.debug(f"Concurrency {self.limit} -> {limit}: {reason}")
+        self.limit = limit
+        self.reason = reason
+        async with self._cond:
+            self._cond.notify_all()
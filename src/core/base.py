@@ -1,10 +1,28 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
+
+from core.cache import CacheStore
+from core.session import HttpSession
 
 
 class VideoPlayer(ABC):
     """Abstract base class for video players (e.g., Streamtape)."""
 
+    # Registry key (see extractors.players.registry)
+    code: str = ""
+    # Strings found in the URLs of the player's pages
+    hosts: Tuple[str, ...] = ()
+    # Names mirror lists give the player, preferred first
+    labels: Tuple[str, ...] = ()
+
+    def __init__(self, session: HttpSession):
+        self.session = session
+
+    @classmethod
+    def handles(cls, url: str) -> bool:
+        url = url.lower()
+        return any(host in url for host in cls.hosts)
+
     @property
     @abstractmethod
     def name(self) -> str:
@@ -19,26 +37,65 @@ class VideoPlayer(ABC):
 class BaseEpisode(ABC):
     """Abstract base class for an anime episode."""
 
-    def __init__(self, number: int, name: str, url: str):
+    def __init__(
+        self,
+        number: int,
+        name: str,
+        url: str,
+        session: HttpSession,
+        cache: Optional[CacheStore] = None,
+    ):
         self.number = number
         self.name = name
         self.url = url
+        self.session = session
+        self.cache = cache if cache is not None else CacheStore()
+        # Overrides the orchestrator output directory (e.g. in batch mode)
+        self.output_dir: Optional[str] = None
 
     @abstractmethod
     async def get_player_url(self) -> Optional[str]:
         """Fetches the player URL (e.g. streamtape url) from the episode page."""
         pass
 
+    async def get_mirror_urls(self) -> List[str]:
+        """Player URLs of every mirror of the episode, preferred first."""
+        player_url = await self.get_player_url()
+        return [player_url] if player_url else []
+
 
 class Platform(ABC):
     """Abstract base class for streaming platforms."""
 
+    def __init__(self, session: HttpSession, cache: Optional[CacheStore] = None):
+        self.session = session
+        self.cache = cache if cache is not None else CacheStore()
+
     @property
     @abstractmethod
     def name(self) -> str:
         pass
 
     @abstractmethod
-    async def get_episodes(self, series_url: str) -> List[BaseEpisode]:
-        """Fetches the list of episodes for a series."""
+    async def get_episodes(
+        self, series_url: str, ttl: Optional[float] = None
+    ) -> List[BaseEpisode]:
+        """
+        Fetches the list of episodes for a series. A cached listing older
+        than `ttl` seconds is revalidated (platform default when None).
+        """
         pass
+
+    def episode_from_url(self, url: str) -> BaseEpisode:
+        """Builds the episode of a single episode page URL."""
+        raise NotImplementedError(f"{self.name} cannot open episode URLs")
+
+    async def iter_episodes(
+        self, series_url: str, ttl: Optional[float] = None
+    ) -> AsyncIterator[BaseEpisode]:
+        """
+        Yields the episodes of a series as they are found. Platforms with
+        paginated listings override it to start yielding after the first page.
+        """
+        for episode in await self.get_episodes(series_url, ttl):
+            yield episode
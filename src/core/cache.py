@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from core.session import HttpSession
+from core.store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+# Freshness of each kind of cached page, in seconds
+EPISODES_TTL = 6 * 3600
+PLAYER_URL_TTL = 30 * 24 * 3600
+# Lifetime of a direct video URL that does not say when it expires
+DIRECT_URL_TTL = 600
+# Direct URLs this close (in seconds) to their expiry are not handed out
+DIRECT_URL_MARGIN = 60
+
+
+def default_cache_dir() -> str:
+    """
+    Returns the per-user cache directory (XDG on Unix, LOCALAPPDATA on Windows).
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "anime-dl")
+
+
+class CacheStore(SqliteStore):
+    """
+    SQLite store for values parsed from scraped pages.
+
+    Each entry keeps the ETag/Last-Modified of the page it came from, so a
+    stale entry can be revalidated with a conditional request instead of
+    being downloaded and parsed again. A disabled store always fetches.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS entries (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            stored_at REAL NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+        """,
+    )
+    DEFAULT_NAME = "cache.sqlite3"
+    default_dir = staticmethod(default_cache_dir)
+
+    def __init__(self, path: Optional[str] = None, refresh: bool = False):
+        super().__init__(path)
+        self.refresh = refresh
+
+    def get(self, kind: str, key: str):
+        """
+        Returns (value, etag, last_modified, stored_at) or None.
+        """
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT value, etag, last_modified, stored_at FROM entries"
+            " WHERE kind = ? AND key = ?",
+            (kind, key),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2], row[3]
+
+    def set(
+        self,
+        kind: str,
+        key: str,
+        value: Any,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, key, json.dumps(value), etag, last_modified, time.time()),
+        )
+        self._db.commit()
+
+    def touch(self, kind: str, key: str):
+        """Marks an entry as fresh again after a 304 Not Modified."""
+        if self._db is None:
+            return
+        self._db.execute(
+            "UPDATE entries SET stored_at = ? WHERE kind = ? AND key = ?",
+            (time.time(), kind, key),
+        )
+        self._db.commit()
+
+    def delete(self, kind: str, key: str):
+        if self._db is None:
+            return
+        self._db.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+        self._db.commit()
+
+    async def fetch(
+        self,
+        session: HttpSession,
+        kind: str,
+        url: str,
+        parse: Callable[[str], Any],
+        ttl: float,
+    ) -> Any:
+        """
+        Returns the parsed value of a page, from the cache when possible.
+
+        Fresh entries are returned without any request. Stale ones are
+        revalidated with If-None-Match/If-Modified-Since. Failed requests are
+        retried with the session's retry policy. Empty parse results are
+        never stored.
+        """
+        entry = None if self.refresh else self.get(kind, url)
+        headers = {}
+        if entry is not None:
+            value, etag, last_modified, stored_at = entry
+            if time.time() - stored_at < ttl:
+                logger.debug(f"Cache hit ({kind}): {url}")
+                return value
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        async def get():
+            resp = await session.get(url, headers=headers, follow_redirects=True)
+            if entry is None or resp.status_code != 304:
+                resp.raise_for_status()
+            return resp
+
+        resp = await session.retry.call(url, get)
+        if resp.status_code == 304:
+            logger.debug(f"Cache revalidated ({kind}): {url}")
+            self.touch(kind, url)
+            return entry[0]
+
+        value = parse(resp.text)
+        if value:
+            self.set(
+                kind,
+                url,
+                value,
+                resp.headers.get("ETag"),
+                resp.headers.get("Last-Modified"),
+            )
+        return value
+
+
+def url_expiry(url: str, default_ttl: float = DIRECT_URL_TTL) -> float:
+    """
+    Returns when a signed URL expires, from its `expires`/`e` query parameter
+    when it has a Unix timestamp there, else `default_ttl` from now.
+    """
+    query = parse_qs(urlparse(url).query)
+    for name in ("expires", "e"):
+        for value in query.get(name, []):
+            if value.isdigit() and int(value) > 1e9:
+                return float(value)
+    return time.time() + default_ttl
+
+
+class DirectUrlCache:
+    """
+    Resolved direct video URLs keyed by player URL, kept in memory and in
+    a CacheStore until shortly before they expire, so retries and later runs
+    skip the player pages.
+    """
+
+    KIND = "direct_url"
+
+    def __init__(
+        self,
+        store: CacheStore,
+        default_ttl: float = DIRECT_URL_TTL,
+        margin: float = DIRECT_URL_MARGIN,
+    ):
+        self.store = store
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self._memory: Dict[str, Tuple[str, float]] = {}
+
+    def get(self, player_url: str) -> Optional[str]:
+        entry = self._memory.get(player_url)
+        if entry is None and not self.store.refresh:
+            stored = self.store.get(self.KIND, player_url)
+            if stored is not None:
+                entry = stored[0]["url"], stored[0]["expires"]
+                self._memory[player_url] = entry
+        if entry is None:
+            return None
+        url, expires = entry
+        if expires - self.margin <= time.time():
+            self.invalidate(player_url)
+            return None
+        logger.debug(f"Cache hit ({self.KIND}): {player_url}")
+        return url
+
+    def set(self, player_url: str, url: str):
+        expires = url_expiry(url, self.default_ttl)
+        self._memory[player_url] = url, expires
+        self.store.set(self.KIND, player_url, {"url": url, "expires": expires})
+
+    def invalidate(self, player_url: str):
+        self._memory.pop(player_url, None)
+        self.store.delete(self.KIND, player_url)
@@ -4,3 +4,15 @@ from enum import Enum
 class SupportedPlayers(str, Enum):
     STREAMTAPE = "streamtape"
     # VIDMOLY = "vidmoly"  # Future support
+
+
+# Defaults shared by the CLI and the modules it imports lazily, kept here so
+# that building the argument parser imports nothing heavy
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Time between two polls of a watched series, in seconds
+DEFAULT_POLL_INTERVAL = 3600
+# HTML parser backends, fastest first (see extractors.parsers)
+PARSER_NAMES = ("selectolax", "lxml", "stream", "bs4")
+# Orders of the download queue, the first is the default (see core.scheduling)
+DOWNLOAD_ORDERS = ("fifo", "sequential", "smallest")
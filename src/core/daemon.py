@@ -0,0 +1,531 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from rich.console import Console
+from rich.text import Text
+
+from core.base import BaseEpisode
+from core.config import DEFAULT_HOST, DEFAULT_PORT
+from core.metrics import metrics
+from core.orchestrator import Orchestrator
+from core.progress import ProgressTracker
+from utils import format_episodes, in_ranges, parse_episodes, sanitize_filename
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) progress events are sent to /events subscribers
+EVENT_INTERVAL = 1.0
+# Comment line sent to idle /events subscribers so proxies keep them open
+HEARTBEAT_INTERVAL = 15.0
+MAX_BODY_SIZE = 64 * 1024
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+}
+
+
+class Job:
+    """A series or episode URL queued in the daemon."""
+
+    def __init__(
+        self,
+        job_id: str,
+        url: str,
+        output: Optional[str] = None,
+        start: Optional[int] = None,
+        select: Optional[List[Tuple[float, float]]] = None,
+    ):
+        self.id = job_id
+        self.url = url
+        self.output = output
+        self.start = start
+        # Episode ranges to download, None for all (see utils.parse_episodes)
+        self.select = select
+        self.state = QUEUED
+        self.episodes = 0
+        self.done = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "output": self.output,
+            "start": self.start,
+            "select": format_episodes(self.select) if self.select else None,
+            "state": self.state,
+            "episodes": self.episodes,
+            "done": self.done,
+            "failed": self.failed,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class EventHub:
+    """Fans events out to every /events subscriber."""
+
+    def __init__(self, backlog: int = 256):
+        self.backlog = backlog
+        self._queues: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.backlog)
+        self._queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._queues.discard(queue)
+
+    def publish(self, event: Dict[str, Any]):
+        event.setdefault("time", time.time())
+        for queue in list(self._queues):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A subscriber that does not keep up loses events, it never
+                # slows the downloads down
+                pass
+
+
+class _EventLog:
+    """File-like object turning console output into "log" events."""
+
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+        self._buffer = ""
+
+    def write(self, data: str) -> int:
+        self._buffer += data
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            if line.strip():
+                self.hub.publish({"type": "log", "message": line})
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Daemon:
+    """
+    Long-lived downloader controlled through a local HTTP/JSON API.
+
+    A single Orchestrator (and so one connection pool, page cache and
+    direct URL cache) serves every job. Jobs run one after the other, each
+    through the usual download pipeline. Pausing a job cancels it: the
+    journal and resume sidecars keep its progress, and resuming queues it
+    again.
+
+    Endpoints:
+        GET  /jobs                  list jobs
+        POST /jobs                  {"url": ..., "output": ..., "start": ...,
+                                     "select": "3-7,12"}
+        GET  /jobs/<id>             one job
+        POST /jobs/<id>/pause       stop a job, keeping its progress
+        POST /jobs/<id>/resume      queue a paused or failed job again
+        POST /jobs/<id>/cancel      stop a job for good (also DELETE /jobs/<id>)
+        GET  /priority              download order and episode boosts
+        POST /priority              {"episodes": "12", "boost": 1}, 0 resets
+        GET  /events                server-sent events: job, progress and log
+        GET  /metrics               metrics in the Prometheus text format
+    """
+
+    def __init__(
+        self,
+        orchestrator: Orchestrator,
+        output_dir: str = ".",
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        token: Optional[str] = None,
+        interval: float = EVENT_INTERVAL,
+    ):
+        self.orchestrator = orchestrator
+        self.output_dir = output_dir
+        self.host = host
+        self.port = port
+        self.token = token
+        self.interval = interval
+        self.jobs: Dict[str, Job] = {}
+        self.events = EventHub()
+        # Nothing is drawn, counters are sampled into progress events and
+        # console messages become log events
+        self.progress = ProgressTracker(
+            None,
+            Console(file=_EventLog(self.events), no_color=True, width=200),
+        )
+        self._ids = itertools.count(1)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    # Jobs
+
+    def enqueue(
+        self,
+        url: str,
+        output: Optional[str] = None,
+        start: Optional[int] = None,
+        select: Optional[List[Tuple[float, float]]] = None,
+    ) -> Job:
+        job = Job(str(next(self._ids)), url, output, start, select)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        self._publish(job)
+        return job
+
+    def pause(self, job: Job):
+        if job.state not in (QUEUED, RUNNING):
+            raise HttpError(409, f"Job {job.id} is {job.state}")
+        self._stop(job, PAUSED)
+
+    def resume(self, job: Job):
+        # A failed job can be resumed too, finished episodes are skipped
+        if job.state not in (PAUSED, FAILED):
+            raise HttpError(409, f"Job {job.id} is {job.state}")
+        job.state = QUEUED
+        self._queue.put_nowait(job)
+        self._publish(job)
+
+    def cancel(self, job: Job):
+        if job.state in (DONE, FAILED, CANCELLED):
+            raise HttpError(409, f"Job {job.id} is {job.state}")
+        self._stop(job, CANCELLED)
+
+    def _stop(self, job: Job, state: str):
+        # A queued job is skipped by the worker, a running one is cancelled
+        job.state = state
+        if state == CANCELLED:
+            job.finished_at = time.time()
+        if job.task is not None:
+            job.task.cancel()
+        self._publish(job)
+
+    def _publish(self, job: Job):
+        self.events.publish({"type": "job", "job": job.to_dict()})
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job.state != QUEUED:
+                continue
+            job.state = RUNNING
+            job.error = None
+            self._publish(job)
+            job.task = asyncio.ensure_future(self._run_job(job))
+            # Waiting (instead of awaiting the task) keeps the worker alive
+            # when the job is cancelled
+            await asyncio.wait([job.task])
+            job.task = None
+            if job.state == RUNNING:
+                job.state = FAILED if job.error or job.failed else DONE
+                job.finished_at = time.time()
+            self._publish(job)
+
+    async def _run_job(self, job: Job):
+        try:
+            job.episodes = job.done = job.failed = 0
+            results = await self.orchestrator.download_episodes(
+                self._episodes(job), self.progress
+            )
+            job.done = results.count(True)
+            job.failed = results.count(False)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.error = str(e)
+
+    async def _episodes(self, job: Job) -> AsyncIterator[BaseEpisode]:
+        """
+        Episodes of a job, in the folder layout of batch mode. A URL without
+        an episode listing is downloaded as a single episode page.
+        """
+        url = job.url.rstrip("/")
+        listing = self.orchestrator.iter_series_episodes(job.url)
+        try:
+            first: Optional[BaseEpisode] = await listing.__anext__()
+        except StopAsyncIteration:
+            first = None
+
+        folder = url.split("/")[-1 if first is not None else -2] or "Anime"
+        folder = sanitize_filename(folder)
+
+        async def episodes():
+            if first is None:
+                yield self.orchestrator.platform.episode_from_url(job.url)
+                return
+            yield first
+            async for ep in listing:
+                yield ep
+
+        output_dir = self._job_dir(job.output or folder)
+        async for ep in episodes():
+            if job.start is not None and ep.number < job.start:
+                continue
+            if job.select is not None and not in_ranges(ep.number, job.select):
+                continue
+            ep.output_dir = output_dir
+            ep.name = f"{folder} {ep.name}"
+            job.episodes += 1
+            yield ep
+
+    def _job_dir(self, output: str) -> str:
+        """Folder of a job inside `output_dir`, HttpError if it would leave it."""
+        root = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(root, output))
+        if os.path.commonpath([root, path]) != root:
+            raise HttpError(400, f"output must stay inside {self.output_dir}")
+        return path
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            transfers = [
+                {
+                    "description": Text.from_markup(t.description).plain,
+                    "completed": t.completed,
+                    "total": t.total,
+                }
+                for t in self.progress.transfers()
+            ]
+            if transfers:
+                self.events.publish({"type": "progress", "transfers": transfers})
+
+    # HTTP
+
+    async def serve_forever(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        logger.debug(f"Daemon listening on http://{self.host}:{self.port}")
+        tasks = [
+            asyncio.ensure_future(self._worker()),
+            asyncio.ensure_future(self._report_progress()),
+        ]
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for job in self.jobs.values():
+                if job.task is not None:
+                    job.task.cancel()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            method, path, headers, body = await self._read_request(reader)
+            if not self._authorized(headers):
+                raise HttpError(401, "Missing or wrong token")
+            if method == "GET" and path == "/events":
+                await self._stream_events(writer)
+                return
+            if method == "GET" and path == "/metrics":
+                data = metrics.render().encode()
+                writer.write(
+                    self._head(200, "text/plain; version=0.0.4", len(data)).encode()
+                    + data
+                )
+                await writer.drain()
+                writer.close()
+                return
+            status, payload = self._route(method, path, body)
+        except HttpError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            logger.error(f"Bad request: {e}", exc_info=True)
+            status, payload = 400, {"error": str(e)}
+
+        try:
+            data = json.dumps(payload).encode()
+            writer.write(
+                self._head(status, "application/json", len(data)).encode() + data
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[str, str, Dict[str, str], Any]:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise HttpError(400, "Malformed request line")
+        method, target, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_SIZE:
+            raise HttpError(413, "Request body too large")
+        body = None
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError as e:
+                raise HttpError(400, "Body is not valid JSON") from e
+        return method.upper(), target.split("?", 1)[0].rstrip("/"), headers, body
+
+    def _authorized(self, headers: Dict[str, str]) -> bool:
+        if not self.token:
+            return True
+        return headers.get("authorization") == f"Bearer {self.token}"
+
+    def _route(self, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        parts = [part for part in path.split("/") if part]
+        if parts == ["priority"]:
+            return self._route_priority(method, body)
+        if parts[:1] != ["jobs"]:
+            raise HttpError(404, f"No such endpoint: {path}")
+
+        if len(parts) == 1:
+            if method == "GET":
+                return 200, [job.to_dict() for job in self.jobs.values()]
+            if method == "POST":
+                if not isinstance(body, dict) or not body.get("url"):
+                    raise HttpError(400, 'Expected {"url": ...}')
+                start = body.get("start")
+                if start is not None and not isinstance(start, int):
+                    raise HttpError(400, "start must be an episode number")
+                output = body.get("output")
+                if output is not None:
+                    if not isinstance(output, str):
+                        raise HttpError(400, "output must be a folder name")
+                    self._job_dir(output)
+                select = None
+                if body.get("select") is not None:
+                    select = self._parse_episodes(body["select"], "select")
+                job = self.enqueue(body["url"], output, start, select)
+                return 201, job.to_dict()
+            raise HttpError(405, f"{method} not allowed on {path}")
+
+        job = self.jobs.get(parts[1])
+        if job is None:
+            raise HttpError(404, f"No such job: {parts[1]}")
+        if len(parts) == 2:
+            if method == "GET":
+                return 200, job.to_dict()
+            if method == "DELETE":
+                self.cancel(job)
+                return 200, job.to_dict()
+            raise HttpError(405, f"{method} not allowed on {path}")
+
+        actions = {"pause": self.pause, "resume": self.resume, "cancel": self.cancel}
+        if len(parts) != 3 or parts[2] not in actions:
+            raise HttpError(404, f"No such endpoint: {path}")
+        if method != "POST":
+            raise HttpError(405, f"{method} not allowed on {path}")
+        actions[parts[2]](job)
+        return 200, job.to_dict()
+
+    def _route_priority(self, method: str, body: Any) -> Tuple[int, Any]:
+        # Boosts apply to episode numbers of the running and later jobs
+        priorities = self.orchestrator.priorities
+        if method == "GET":
+            return 200, priorities.to_dict()
+        if method != "POST":
+            raise HttpError(405, f"{method} not allowed on /priority")
+        if not isinstance(body, dict) or "episodes" not in body:
+            raise HttpError(400, 'Expected {"episodes": ..., "boost": ...}')
+        ranges = self._parse_episodes(body["episodes"], "episodes")
+        value = body.get("boost", 1)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise HttpError(400, "boost must be a number")
+        self.orchestrator.boost(ranges, value)
+        return 200, priorities.to_dict()
+
+    @staticmethod
+    def _parse_episodes(value: Any, field: str) -> List[Tuple[float, float]]:
+        try:
+            return parse_episodes(str(value))
+        except ValueError as e:
+            raise HttpError(400, f"{field}: {e}") from e
+
+    async def _stream_events(self, writer: asyncio.StreamWriter):
+        queue = self.events.subscribe()
+        try:
+            writer.write(
+                self._head(
+                    200, "text/event-stream", extra=["Cache-Control: no-cache"]
+                ).encode()
+            )
+            # The current state of every job first, then changes as they happen
+            for job in self.jobs.values():
+                writer.write(self._event({"type": "job", "job": job.to_dict()}))
+            await writer.drain()
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                    writer.write(self._event(event))
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.events.unsubscribe(queue)
+            writer.close()
+
+    @staticmethod
+    def _event(event: Dict[str, Any]) -> bytes:
+        return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+
+    @staticmethod
+    def _head(
+        status: int,
+        content_type: str,
+        length: Optional[int] = None,
+        extra: Optional[List[str]] = None,
+    ) -> str:
+        lines = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            "Connection: close",
+        ]
+        if length is not None:
+            lines.append(f"Content-Length: {length}")
+        lines.extend(extra or [])
+        return "\r\n".join(lines) + "\r\n\r\n"
@@ -1,31 +1,119 @@
 import os
 import time
+import json
 import httpx
+import logging
 import re
 import asyncio
+from contextlib import contextmanager
+from typing import Awaitable, Callable, List, Optional
 from urllib.parse import urlparse
-from rich.progress import (
-    Progress,
-    SpinnerColumn,
-    BarColumn,
-    TextColumn,
-    DownloadColumn,
-    TransferSpeedColumn,
-    TimeRemainingColumn,
-)
 from rich.console import Console
 
+from core.integrity import StreamHasher
+from core.journal import DOWNLOADING, JournalEntry
+from core.library import LibraryStore
+from core.metrics import host_of, metrics
+from core.progress import ProgressTracker, make_progress
+from core.ratelimit import TokenBucket
+from core.retry import is_retryable
+from core.session import HttpSession
+from core.writer import DEFAULT_BUFFER_SIZE, FileWriter, preallocate
+
+logger = logging.getLogger(__name__)
 _console = Console()
 
+# Segments smaller than this are not worth a dedicated connection
+MIN_SEGMENT_SIZE = 1024 * 1024
+# How often (in seconds) the per-segment resume state is flushed to disk
+STATE_SAVE_INTERVAL = 1.0
+# `on_tail` is called when the transfer is estimated this close to its end,
+# in seconds
+TAIL_LEAD = 5.0
+
+
+class RangeIgnoredError(httpx.HTTPError):
+    """The server answered a Range request with the whole file."""
+
+
+def is_expired_error(error: BaseException) -> bool:
+    """Signed video URLs answer 403 or 410 once they have expired."""
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in (
+        403,
+        410,
+    )
+
+
+def episode_filename(output_dir: str, ep_num: int) -> str:
+    """Files are named after the output folder, e.g. "One piece/One piece ep01.mp4"."""
+    series_name = os.path.basename(os.path.normpath(output_dir))
+    return f"{series_name} ep{ep_num:02d}.mp4"
+
 
 class SmartDownloader:
-    def __init__(self, output_dir, max_retries=3):
+    def __init__(
+        self,
+        session: HttpSession,
+        output_dir,
+        max_retries=3,
+        segments=1,
+        monitor=None,
+        rate_limit: Optional[TokenBucket] = None,
+        episode_rate: Optional[float] = None,
+        read_size: Optional[int] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        journal: Optional[JournalEntry] = None,
+        checksum: Optional[str] = None,
+        refresh_url: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+        mirrors: Optional[List[str]] = None,
+        library: Optional[LibraryStore] = None,
+        priority: Optional[Callable[[int], tuple]] = None,
+        head: Optional[httpx.Response] = None,
+        on_tail: Optional[Callable[[], None]] = None,
+    ):
+        self.session = session
         self.output_dir = output_dir
         self.max_retries = max_retries
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124"
-        }
+        self.segments = max(1, segments)
+        # Optional sink for received bytes and errors (see core.adaptive)
+        self.monitor = monitor
+        # Bandwidth shared by every download, and the cap of this one
+        self.buckets = [rate_limit] if rate_limit else []
+        if episode_rate:
+            self.buckets.append(TokenBucket(episode_rate))
+        # None reads chunks as they come off the socket, without re-chunking
+        self.read_size = read_size
+        # Received bytes are written to disk in batches of this size
+        self.buffer_size = buffer_size
+        # Job journal entry of the episode, see core.journal
+        self.journal = journal
+        # Hash algorithm of the streaming checksum, None to skip hashing.
+        # `digest` holds the result of the last download.
+        self.checksum = checksum
+        self.digest: Optional[str] = None
+        self._hasher: Optional[StreamHasher] = None
+        # Called once to get a new direct URL when the current one expired
+        self.refresh_url = refresh_url
+        # Other direct URLs of the same video, tried in order when one fails
+        self.mirrors = list(mirrors or [])
+        # Content-addressed store checked before downloading, see core.library.
+        # `linked` tells whether the last download came from it.
+        self.library = library
+        self.linked = False
+        # Gives the bandwidth priority of this download from the bytes it
+        # has left, see core.scheduling
+        self.priority = priority
+        self._remaining = 0
+        # HEAD response of the first URL, already fetched (see prefetch in
+        # core.orchestrator), used instead of the first HEAD request
+        self.head = head
+        # Called once near the end of the transfer, to get the next one ready
+        self.on_tail = on_tail
+        self._received = 0
+        self._started = 0.0
+
+    def _count_retry(self, url, reason):
+        metrics.counter("retries_total", host=host_of(url), reason=reason).inc()
 
     def _get_filename(self, response, url, override_name=None):
         if override_name:
@@ -43,10 +131,24 @@ class SmartDownloader:
             name = f"video_{int(time.time())}.mp4"
         return name
 
+    def _state_path(self, path):
+        return path + ".parts"
+
     def _check_existing(self, path, remote_size):
         if not os.path.exists(path):
             return 0, "wb"
 
+        # Without a size nothing proves the file or its segments are complete
+        if not remote_size:
+            if os.path.exists(self._state_path(path)):
+                os.remove(self._state_path(path))
+            return 0, "wb"
+
+        # A preallocated file already has its final size, the sidecar tells us
+        # whether the segments were actually completed.
+        if os.path.exists(self._state_path(path)):
+            return 0, "r+b"
+
         local_size = os.path.getsize(path)
         if local_size == remote_size:
             return -1, None
@@ -56,80 +158,394 @@ class SmartDownloader:
 
         return local_size, "ab"
 
+    @contextmanager
+    def _progress_task(self, progress, path, total_size, resume_byte):
+        """
+        Yields the Transfer counters of this download, creating a standalone
+        tracker when no shared one is given.
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        self._remaining = (total_size or 0) - resume_byte
+        self._received = 0
+        self._started = time.monotonic()
+        if progress:
+            transfer = progress.add(
+                f"[green]Downloading {name}", total=total_size, completed=resume_byte
+            )
+            try:
+                yield transfer
+            finally:
+                progress.finish(transfer)
+            return
+
+        _console.print(f"[blue]Downloading {name}")
+        with ProgressTracker(make_progress(_console)) as tracker:
+            yield tracker.add(
+                "[green]Downloading ", total=total_size, completed=resume_byte
+            )
+
     async def _perform_download(
         self, url, path, resume_byte, total_size, ep_num: int, progress=None, mode=None
     ):
         if not mode and resume_byte == total_size:
             return
-        headers = self.headers.copy()
+        headers = {}
         if resume_byte > 0:
             headers["Range"] = f"bytes={resume_byte}-"
+        await self._catch_up(path, resume_byte)
 
-        async with httpx.AsyncClient(headers=headers, timeout=30) as client:
-            async with client.stream("GET", url) as r:
-                r.raise_for_status()
-                with open(path, mode) as f:
-                    if progress:
-                        task = progress.add_task(
-                            f"[green]Downloading ep{ep_num:02d}",
-                            total=total_size,
-                            completed=resume_byte,
-                        )
-                        async for chunk in r.aiter_bytes(chunk_size=8192):
-                            f.write(chunk)
-                            progress.update(task, advance=len(chunk))
-                    else:
-                        _console.print(f"[blue]Downloading ep{ep_num:02d}")
-                        with Progress(
-                            SpinnerColumn(),
-                            TextColumn("{task.description}"),
-                            BarColumn(),
-                            DownloadColumn(),
-                            TransferSpeedColumn(),
-                            TimeRemainingColumn(),
-                            console=_console,
-                        ) as inner_progress:
-                            task = inner_progress.add_task(
-                                "[green]Downloading ",
-                                total=total_size,
-                                completed=resume_byte,
-                            )
-                            async for chunk in r.aiter_bytes(chunk_size=8192):
-                                f.write(chunk)
-                                inner_progress.update(task, advance=len(chunk))
+        host = host_of(url)
+        started = time.monotonic()
+        async with self.session.stream("GET", url, headers=headers) as r:
+            self._record_ttfb(host, started)
+            r.raise_for_status()
+            if resume_byte > 0 and r.status_code != 206:
+                # The whole file is coming: appending it would corrupt the file
+                logger.warning(f"Server ignored Range request, restarting {path}")
+                resume_byte, mode = 0, "wb"
+                self._hasher = StreamHasher(self.checksum) if self.checksum else None
+            if mode == "wb":
+                open(path, "wb").close()
+            writer = FileWriter(
+                path,
+                resume_byte,
+                self.buffer_size,
+                self._hasher,
+                metrics.counter("bytes_written_total", host=host),
+            )
+            with self._record_transfer(host, writer):
+                async with writer:
+                    with self._progress_task(
+                        progress, path, total_size, resume_byte
+                    ) as transfer:
+                        async for chunk in self._iter_body(r):
+                            await writer.write(chunk)
+                            transfer.completed += len(chunk)
+                            if self.monitor:
+                                self.monitor.add_bytes(len(chunk))
+                            await self._throttle(len(chunk))
+
+    def _record_ttfb(self, host, started):
+        metrics.histogram("ttfb_seconds", host=host).observe(time.monotonic() - started)
+
+    @contextmanager
+    def _record_transfer(self, host, writer):
+        """Observes the throughput of a response body once it ends."""
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            if writer.flushed and elapsed > 0:
+                metrics.histogram(
+                    "transfer_bytes_per_second", host=host, outcome=outcome
+                ).observe(writer.flushed / elapsed)
+
+    def _iter_body(self, response):
+        # Undecoded bytes skip a decoder pass when the body is not compressed
+        encoding = response.headers.get("Content-Encoding", "identity").lower()
+        if encoding == "identity":
+            return response.aiter_raw(self.read_size)
+        return response.aiter_bytes(self.read_size)
+
+    async def _throttle(self, size):
+        priority = self.priority(self._remaining) if self.priority else ()
+        self._remaining -= size
+        self._received += size
+        if self.on_tail is not None:
+            elapsed = time.monotonic() - self._started
+            # Time left at the average speed so far
+            if self._remaining * elapsed <= TAIL_LEAD * self._received:
+                on_tail, self.on_tail = self.on_tail, None
+                on_tail()
+        for bucket in self.buckets:
+            if bucket.limited:
+                await bucket.consume(size, priority)
+
+    def _can_use_ranges(self, response, remote_size):
+        return (
+            remote_size > 0
+            and response.headers.get("Accept-Ranges", "").lower() != "none"
+        )
+
+    def _plan_segments(self, total_size):
+        """
+        Splits the file into byte ranges as [start, end, done] triples.
+        """
+        count = max(1, min(self.segments, total_size // MIN_SEGMENT_SIZE))
+        step = total_size // count
+        segments = []
+        for i in range(count):
+            start = i * step
+            end = total_size - 1 if i == count - 1 else start + step - 1
+            segments.append([start, end, 0])
+        return segments
+
+    def _load_state(self, path, total_size):
+        state_path = self._state_path(path)
+        if not os.path.exists(state_path) or not os.path.exists(path):
+            return None
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("size") != total_size:
+            return None
+        return state.get("segments")
+
+    def _save_state(self, path, total_size, segments):
+        # A torn sidecar fails to parse in _load_state and every finished
+        # segment would be fetched again, so it is swapped in whole
+        state_path = self._state_path(path)
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": total_size, "segments": segments}, f)
+        os.replace(tmp_path, state_path)
+        if self.journal:
+            self.journal.update(bytes_done=sum(done for _, _, done in segments))
+
+    async def _download_segment(self, url, path, segment, on_chunk):
+        start, end, done = segment
+        if start + done > end:
+            return
+
+        headers = {"Range": f"bytes={start + done}-{end}"}
+        host = host_of(url)
+        started = time.monotonic()
+        async with self.session.stream(
+            "GET", url, headers=headers, follow_redirects=True
+        ) as r:
+            self._record_ttfb(host, started)
+            r.raise_for_status()
+            # A plain 200 is only acceptable when we asked for the whole file
+            whole_file = start + done == 0 and r.headers.get("Content-Length") == str(
+                end + 1
+            )
+            if r.status_code != 206 and not whole_file:
+                raise RangeIgnoredError(
+                    f"Server ignored Range request (status {r.status_code})"
+                )
+            writer = FileWriter(
+                path,
+                start + done,
+                self.buffer_size,
+                self._hasher,
+                metrics.counter("bytes_written_total", host=host),
+            )
+            with self._record_transfer(host, writer):
+                async with writer:
+                    try:
+                        async for chunk in self._iter_body(r):
+                            await writer.write(chunk)
+                            # Only bytes that reached the disk count for resuming
+                            segment[2] = done + writer.flushed
+                            on_chunk(len(chunk))
+                            await self._throttle(len(chunk))
+                    finally:
+                        await writer.flush()
+                        segment[2] = done + writer.flushed
+
+    async def _catch_up(self, path, upto):
+        if self._hasher is not None and upto > self._hasher.offset:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._hasher.catch_up, path, upto
+            )
+
+    async def _perform_segmented_download(
+        self, url, path, total_size, ep_num: int, progress=None
+    ):
+        """
+        Downloads the file over one or more concurrent Range requests, each
+        one writing to its own offset of a preallocated file.
+        """
+        segments = self._load_state(path, total_size)
+        if segments is None:
+            segments = self._plan_segments(total_size)
+            with open(path, "wb") as f:
+                preallocate(f.fileno(), total_size)
+            self._save_state(path, total_size, segments)
+        # Bytes already on disk before the first pending one are hashed up front
+        await self._catch_up(path, segments[0][0] + segments[0][2])
+
+        completed = sum(done for _, _, done in segments)
+        last_save = time.monotonic()
+
+        with self._progress_task(progress, path, total_size, completed) as transfer:
+
+            def on_chunk(size):
+                nonlocal last_save
+                transfer.completed += size
+                if self.monitor:
+                    self.monitor.add_bytes(size)
+                now = time.monotonic()
+                if now - last_save >= STATE_SAVE_INTERVAL:
+                    self._save_state(path, total_size, segments)
+                    last_save = now
+
+            tasks = [
+                asyncio.ensure_future(self._download_segment(url, path, seg, on_chunk))
+                for seg in segments
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Stop the sibling segments so none keeps writing after a failure
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            finally:
+                self._save_state(path, total_size, segments)
+
+        os.remove(self._state_path(path))
 
     async def download(self, url: str, ep_num: int, progress=None):
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        filename = f"{self.output_dir} ep{ep_num:02d}.mp4"
+        filename = episode_filename(self.output_dir, ep_num)
 
-        for attempt in range(self.max_retries + 1):
+        attempt = 0
+        refreshed = False
+        while True:
+            # Every worker holds off while the host's circuit breaker is open
+            await self.session.retry.wait(url)
             try:
-                async with httpx.AsyncClient(
-                    headers=self.headers, follow_redirects=True
-                ) as client:
-                    r = await client.head(url)
-                    remote_size = int(r.headers.get("Content-Length", 0))
-                    final_name = self._get_filename(r, url, filename)
-                    output_path = os.path.join(self.output_dir, final_name)
+                r, self.head = self.head, None
+                if r is None:
+                    with metrics.timer("head_seconds", host=host_of(url)) as timing:
+                        r = await self.session.head(url, follow_redirects=True)
+                        timing.outcome = str(r.status_code)
+                # Hosts refusing HEAD get a plain GET, other errors are retried
+                if r.status_code not in (405, 501):
+                    r.raise_for_status()
+                remote_size = (
+                    int(r.headers.get("Content-Length", 0)) if r.is_success else 0
+                )
+                final_name = self._get_filename(r, url, filename)
+                output_path = os.path.join(self.output_dir, final_name)
+
+                self.digest = None
+                self.linked = False
+                obj = (
+                    self.library.lookup(url, remote_size)
+                    if self.library and remote_size
+                    else None
+                )
+                if obj is not None:
+                    # Same source and size already stored: no body request
+                    self.library.link(obj, output_path)
+                    if obj["algorithm"] == self.checksum:
+                        self.digest = obj["hash"]
+                    self.linked = True
+                    if self.journal:
+                        # The object may have been post-processed, so its size
+                        # and not the source's is the one to expect
+                        self.journal.update(path=output_path, size=obj["size"])
+                    return output_path, True
 
+                self._hasher = StreamHasher(self.checksum) if self.checksum else None
                 resume_byte, mode = self._check_existing(output_path, remote_size)
                 if resume_byte == -1:
-                    return output_path, True
+                    entry = self.journal.get() if self.journal else None
+                    if not (
+                        entry
+                        and entry["state"] == DOWNLOADING
+                        and entry["path"] == output_path
+                    ):
+                        return output_path, True
+                    # The journal saw this download start but never finish, so
+                    # a size matching Content-Length does not prove it is whole
+                    resume_byte, mode = 0, "wb"
+                if mode == "wb" and os.path.exists(output_path):
+                    # The old file may be a hardlink into the library, whose
+                    # bytes must not be truncated
+                    os.remove(output_path)
+                if self.journal:
+                    self.journal.update(
+                        state=DOWNLOADING, path=output_path, size=remote_size or None
+                    )
 
-                await self._perform_download(
-                    url, output_path, resume_byte, remote_size, ep_num, progress, mode
-                )
+                # Whenever the size is known the file is preallocated and
+                # fetched by ranges, with resume state kept in a sidecar
+                if mode == "r+b" or (
+                    mode == "wb" and self._can_use_ranges(r, remote_size)
+                ):
+                    try:
+                        await self._perform_segmented_download(
+                            url, output_path, remote_size, ep_num, progress
+                        )
+                    except RangeIgnoredError as e:
+                        # Segments cannot resume without ranges: drop their
+                        # state and fetch the file again as one stream
+                        logger.warning(f"{e}, restarting {output_path} in one stream")
+                        if os.path.exists(self._state_path(output_path)):
+                            os.remove(self._state_path(output_path))
+                        self._hasher = (
+                            StreamHasher(self.checksum) if self.checksum else None
+                        )
+                        await self._perform_download(
+                            url, output_path, 0, remote_size, ep_num, progress, "wb"
+                        )
+                else:
+                    await self._perform_download(
+                        url,
+                        output_path,
+                        resume_byte,
+                        remote_size,
+                        ep_num,
+                        progress,
+                        mode,
+                    )
 
+                if self._hasher is not None:
+                    # Only reads what was not hashed while being written
+                    await self._catch_up(output_path, os.path.getsize(output_path))
+                    self.digest = self._hasher.hexdigest()
+                self.session.retry.record_success(url)
                 return output_path, False
             except Exception as e:
+                error_console = progress.console if progress else _console
+                # An expired URL is resolved again once, then the download
+                # resumes from what is already on disk without waiting
+                if is_expired_error(e) and self.refresh_url and not refreshed:
+                    refreshed = True
+                    fresh_url = await self.refresh_url()
+                    if fresh_url:
+                        error_console.print(
+                            "[yellow]Direct URL expired, resuming with a new one...[/]"
+                        )
+                        self._count_retry(url, "expired")
+                        url = fresh_url
+                        continue
+                if self.monitor:
+                    self.monitor.record_error(e)
+                self.session.retry.record_failure(url, e)
+                # Switching mirrors keeps the bytes on disk when sizes match
+                if self.mirrors:
+                    self._count_retry(url, "mirror")
+                    url = self.mirrors.pop(0)
+                    error_console.print(
+                        f"[yellow]Error: {e}. Switching to the next mirror...[/]"
+                    )
+                    continue
+                if not is_retryable(e):
+                    error_console.print(f"[red]Error: {e}. Not retrying.[/]")
+                    raise e
                 if attempt < self.max_retries:
-                    error_console = progress.console if progress else _console
-                    error_console.print(f"[yellow]Error: {e}. Retrying in 5s...[/]")
-                    await asyncio.sleep(5)
+                    delay = self.session.retry.backoff(attempt, e)
+                    attempt += 1
+                    self._count_retry(url, "retry")
+                    error_console.print(
+                        f"[yellow]Error: {e}. Retrying in {delay:.1f}s...[/]"
+                    )
+                    await asyncio.sleep(delay)
                 else:
-                    error_console = progress.console if progress else _console
                     error_console.print(
                         f"[red]Failed after {self.max_retries} attempts.[/]"
                     )
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+logger = logging.getLogger(__name__)
+
+# File kept in each series directory
+MANIFEST_NAME = "manifest.json"
+READ_SIZE = 1024 * 1024
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm")
+
+
+def default_algorithm() -> str:
+    """BLAKE3 when installed (much faster on multi-core CPUs), else BLAKE2b."""
+    return "blake3" if blake3 is not None else "blake2b"
+
+
+def algorithm_available(algorithm: str) -> bool:
+    if algorithm == "blake3":
+        return blake3 is not None
+    return algorithm in hashlib.algorithms_available
+
+
+def new_hash(algorithm: str):
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise ValueError(
+                "blake3 is not installed, install it with: pip install -e .[blake3]"
+            )
+        return blake3.blake3()
+    return hashlib.new(algorithm)
+
+
+def hash_file(path: str, algorithm: str) -> str:
+    """Hashes a whole file. Top-level so it can run in a process pool."""
+    digest = new_hash(algorithm)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StreamHasher:
+    """
+    Hashes a file in order while it is being written.
+
+    Writers offer each batch with its file offset, and only the batch that
+    extends the hashed prefix is taken, so a single-stream download is hashed
+    with no second read. Anything else (bytes already on disk when resuming,
+    segments past the first one) is read back by `catch_up`.
+    """
+
+    def __init__(self, algorithm: Optional[str] = None):
+        self.algorithm = algorithm or default_algorithm()
+        self.offset = 0
+        self._hash = new_hash(self.algorithm)
+        self._lock = threading.Lock()
+
+    def update(self, data, offset: int) -> bool:
+        with self._lock:
+            if offset != self.offset:
+                return False
+            self._hash.update(data)
+            self.offset += len(data)
+            return True
+
+    def catch_up(self, path: str, upto: int):
+        """Hashes the bytes of `path` between the hashed prefix and `upto`."""
+        with self._lock, open(path, "rb") as f:
+            f.seek(self.offset)
+            while self.offset < upto:
+                chunk = f.read(min(READ_SIZE, upto - self.offset))
+                if not chunk:
+                    raise OSError(f"{path} is shorter than {upto} bytes")
+                self._hash.update(chunk)
+                self.offset += len(chunk)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class Manifest:
+    """
+    Size and checksum of every finished file of a series directory, stored
+    as JSON next to the files.
+
+    A manifest written with an algorithm that is not installed here (blake3
+    is optional) switches to the default one. Its older entries keep their
+    hash and algorithm, and are re-hashed by `verify --update`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.algorithm = default_algorithm()
+        self.files: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.algorithm = data.get("algorithm", self.algorithm)
+            self.files = data.get("files", {})
+        if not algorithm_available(self.algorithm):
+            logger.warning(
+                f"{path} uses {self.algorithm}, which is not installed; "
+                f"new files are hashed with {default_algorithm()}"
+            )
+            for entry in self.files.values():
+                entry.setdefault("algorithm", self.algorithm)
+            self.algorithm = default_algorithm()
+
+    @classmethod
+    def for_dir(cls, directory: str) -> "Manifest":
+        return cls(os.path.join(directory, MANIFEST_NAME))
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(self.path) or "."
+
+    def set(self, name: str, size: int, digest: str):
+        self.files[name] = {"size": size, "hash": digest}
+        self.save()
+
+    def save(self):
+        # Rewritten after every episode: swapping the file in whole keeps the
+        # hashes of the earlier episodes if the process dies mid-write
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"algorithm": self.algorithm, "files": self.files},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        os.replace(tmp_path, self.path)
+
+
+def find_manifests(paths: List[str], include_unlisted: bool = False) -> List[str]:
+    """
+    Returns the manifest paths found under the given directories. With
+    `include_unlisted`, directories holding videos but no manifest yet are
+    returned too.
+    """
+    found = []
+    for root_path in paths:
+        for directory, _, files in os.walk(root_path):
+            if MANIFEST_NAME in files or (
+                include_unlisted
+                and any(name.endswith(VIDEO_EXTENSIONS) for name in files)
+            ):
+                found.append(os.path.join(directory, MANIFEST_NAME))
+    return sorted(found)
+
+
+def verify_manifests(
+    manifest_paths: List[str], jobs: Optional[int] = None, update: bool = False
+) -> Iterator[Tuple[str, str]]:
+    """
+    Re-hashes the files listed in each manifest on a pool of processes and
+    yields (path, status) pairs. Status is one of "ok",
+    "missing", "size mismatch", "corrupt", or "added" for videos recorded
+    into the manifest because of `update`. Entries hashed with an algorithm
+    that is not installed are "skipped", or with `update` hashed again and
+    "rehashed".
+    """
+    manifests = [Manifest(path) for path in manifest_paths]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for manifest in manifests:
+            for name, entry in sorted(manifest.files.items()):
+                path = os.path.join(manifest.directory, name)
+                if not os.path.exists(path):
+                    yield path, "missing"
+                elif os.path.getsize(path) != entry["size"]:
+                    yield path, "size mismatch"
+                elif not algorithm_available(
+                    entry.get("algorithm", manifest.algorithm)
+                ):
+                    if update:
+                        future = pool.submit(hash_file, path, manifest.algorithm)
+                        futures.append((manifest, name, path, future, "rehashed"))
+                    else:
+                        yield path, "skipped"
+                else:
+                    future = pool.submit(hash_file, path, manifest.algorithm)
+                    futures.append((manifest, name, path, future, None))
+            if update:
+                for name in sorted(os.listdir(manifest.directory)):
+                    path = os.path.join(manifest.directory, name)
+                    # Files with a resume sidecar are still being downloaded
+                    if (
+                        name.endswith(VIDEO_EXTENSIONS)
+                        and name not in manifest.files
+                        and not os.path.exists(path + ".parts")
+                    ):
+                        future = pool.submit(hash_file, path, manifest.algorithm)
+                        futures.append((manifest, name, path, future, "added"))
+
+        for manifest, name, path, future, recorded in futures:
+            digest = future.result()
+            if recorded:
+                manifest.set(name, os.path.getsize(path), digest)
+                yield path, recorded
+            elif digest == manifest.files[name]["hash"]:
+                yield path, "ok"
+            else:
+                yield path, "corrupt"
@@ -0,0 +1,136 @@
+import os
+import time
+from typing import Any, Dict, Optional
+
+from core.store import SqliteStore
+
+# File kept in each output directory
+JOURNAL_NAME = ".anime-dl-journal.sqlite3"
+
+# Episode states, in the order a download goes through them
+QUEUED = "queued"
+RESOLVED = "resolved"
+DOWNLOADING = "downloading"
+COMPLETE = "complete"
+
+_COLUMNS = (
+    "url",
+    "state",
+    "direct_url",
+    "resolved_at",
+    "path",
+    "size",
+    "bytes_done",
+    "verified",
+    "updated_at",
+)
+
+
+class Journal(SqliteStore):
+    """
+    SQLite record of the episodes downloaded into one output directory.
+
+    Each episode moves through queued, resolved (with its direct URL),
+    downloading (with bytes done) and complete. A complete entry whose file
+    still has the recorded size is skipped on restart without any request.
+    A disabled journal records nothing.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS episodes (
+            number INTEGER PRIMARY KEY,
+            url TEXT,
+            state TEXT NOT NULL,
+            direct_url TEXT,
+            resolved_at REAL,
+            path TEXT,
+            size INTEGER,
+            bytes_done INTEGER NOT NULL DEFAULT 0,
+            verified INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+        """,
+    )
+    # One fsync per checkpoint instead of one per state change
+    PRAGMAS = SqliteStore.PRAGMAS + ("synchronous=NORMAL",)
+
+    @classmethod
+    def for_dir(cls, output_dir: str) -> "Journal":
+        return cls(os.path.join(output_dir, JOURNAL_NAME))
+
+    def get(self, number: int) -> Optional[Dict[str, Any]]:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM episodes WHERE number = ?",
+            (number,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(_COLUMNS, row))
+
+    def update(self, number: int, **fields):
+        """Creates or updates the entry of an episode with the given columns."""
+        if self._db is None:
+            return
+        fields["updated_at"] = time.time()
+        self._db.execute(
+            "INSERT OR IGNORE INTO episodes (number, state, updated_at)"
+            " VALUES (?, ?, ?)",
+            (number, QUEUED, fields["updated_at"]),
+        )
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._db.execute(
+            f"UPDATE episodes SET {assignments} WHERE number = ?",
+            list(fields.values()) + [number],
+        )
+        self._db.commit()
+
+    def claim(self, number: int, url: str):
+        """
+        Records `url` as episode `number` of the folder. An entry left there
+        by another URL with the same number (another version, or another
+        series sharing the folder) is started over, so its state, size and
+        direct URL are never taken for this episode's.
+        """
+        if self._db is None:
+            return
+        entry = self.get(number)
+        if entry is not None and entry["url"] not in (None, url):
+            self._db.execute("DELETE FROM episodes WHERE number = ?", (number,))
+        self.update(number, url=url)
+
+    def is_complete(self, number: int, url: Optional[str] = None) -> bool:
+        """
+        True when the episode finished and its file still has the recorded
+        size. With `url`, the entry must also have been recorded for that
+        episode page. Only the local file is checked.
+        """
+        entry = self.get(number)
+        if entry is None or entry["state"] != COMPLETE or not entry["path"]:
+            return False
+        if url is not None and entry["url"] not in (None, url):
+            return False
+        try:
+            size = os.path.getsize(entry["path"])
+        except OSError:
+            return False
+        return entry["size"] is None or size == entry["size"]
+
+    def entry(self, number: int) -> "JournalEntry":
+        return JournalEntry(self, number)
+
+
+class JournalEntry:
+    """The journal entry of one episode, handed to its downloader."""
+
+    def __init__(self, journal: Journal, number: int):
+        self.journal = journal
+        self.number = number
+
+    def get(self) -> Optional[Dict[str, Any]]:
+        return self.journal.get(self.number)
+
+    def update(self, **fields):
+        self.journal.update(self.number, **fields)
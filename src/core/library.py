@@ -0,0 +1,209 @@
+import errno
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from core.store import SqliteStore
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that change every time a direct URL is resolved
+VOLATILE_PARAMS = frozenset(
+    {"expires", "e", "token", "ip", "sig", "signature", "st", "t"}
+)
+# ioctl cloning a whole file on Linux (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+_COLUMNS = ("hash", "algorithm", "size", "path", "stored_at")
+
+
+def source_key(url: str) -> str:
+    """
+    Key of a download source: the URL without its volatile query parameters,
+    so the same video resolved twice (with different tokens) has one key.
+    """
+    parts = urlparse(url)
+    query = [
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in VOLATILE_PARAMS
+    ]
+    return urlunparse(parts._replace(query=urlencode(sorted(query)), fragment=""))
+
+
+def _reflink(source: str, target: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+
+
+def link_file(source: str, target: str) -> str:
+    """
+    Makes `target` share the bytes of `source`: a hardlink, else a reflink
+    (copy-on-write clone), else a plain copy. Returns the method used.
+    """
+    # Renaming over another link to the same file would do nothing at all
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return "hardlink"
+    tmp_path = target + ".link"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+        method = "hardlink"
+    except OSError as e:
+        # Other filesystem, or one without hardlinks
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        if _reflink(source, tmp_path):
+            method = "reflink"
+        else:
+            shutil.copyfile(source, tmp_path)
+            method = "copy"
+    # Replacing in one step never leaves a missing or partial target
+    os.replace(tmp_path, target)
+    return method
+
+
+class LibraryStore(SqliteStore):
+    """
+    Content-addressed store of finished videos shared by every output
+    folder.
+
+    Each video is kept once under `objects/`, named after its hash, and the
+    series folders hold hardlinks (or reflinks) to it. An SQLite index maps
+    sources (the episode page URL and the direct URL without its token) to
+    objects, so a video already in the library is linked into a new folder
+    without any request. The recorded size is checked on every lookup.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS objects (
+            hash TEXT PRIMARY KEY,
+            algorithm TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            stored_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sources (
+            key TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            size INTEGER
+        )
+        """,
+    )
+
+    def _db_path(self, path: str) -> str:
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        return os.path.join(path, "index.sqlite3")
+
+    def _object_path(self, digest: str, algorithm: str) -> str:
+        return os.path.join(self.path, "objects", algorithm, digest[:2], digest)
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        """The object with this hash, if its file still has the recorded size."""
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM objects WHERE hash = ?", (digest,)
+        ).fetchone()
+        if row is None:
+            return None
+        obj = dict(zip(_COLUMNS, row))
+        try:
+            if os.path.getsize(obj["path"]) == obj["size"]:
+                return obj
+        except OSError:
+            pass
+        logger.warning(f"Library object {digest} is missing or damaged, dropping it")
+        self._forget(digest)
+        return None
+
+    def lookup(self, url: str, size: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        The object downloaded from `url` (any token), or None. With `size`,
+        the source must have had that size when it was downloaded (the object
+        may differ after post-processing).
+        """
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT hash, size FROM sources WHERE key = ?", (source_key(url),)
+        ).fetchone()
+        if row is None or (size is not None and row[1] not in (None, size)):
+            return None
+        return self.get(row[0])
+
+    def link(self, obj: Dict[str, Any], target: str) -> str:
+        """Places the object at `target`, replacing what was there."""
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        return link_file(obj["path"], target)
+
+    def add(
+        self,
+        path: str,
+        sources: Iterable[str],
+        digest: str,
+        algorithm: str,
+        source_size: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Stores a finished file under its hash and records the URLs it came
+        from, with their size (by default the file's). A file whose bytes
+        are already stored is replaced by a link to the existing object.
+        """
+        if self._db is None:
+            return None
+        size = os.path.getsize(path)
+
+        obj = self.get(digest)
+        if obj is None:
+            obj = {
+                "hash": digest,
+                "algorithm": algorithm,
+                "size": size,
+                "path": self._object_path(digest, algorithm),
+                "stored_at": time.time(),
+            }
+            os.makedirs(os.path.dirname(obj["path"]), exist_ok=True)
+            method = link_file(path, obj["path"])
+            logger.debug(f"Stored {path} in the library ({method})")
+            self._db.execute(
+                f"INSERT OR REPLACE INTO objects ({', '.join(_COLUMNS)})"
+                " VALUES (?, ?, ?, ?, ?)",
+                [obj[name] for name in _COLUMNS],
+            )
+        elif not os.path.samefile(path, obj["path"]):
+            # Same bytes under another name: keep a single copy
+            method = self.link(obj, path)
+            logger.debug(f"Deduplicated {path} against the library ({method})")
+
+        self._db.executemany(
+            "INSERT OR REPLACE INTO sources (key, hash, size) VALUES (?, ?, ?)",
+            [(source_key(url), digest, source_size or size) for url in sources if url],
+        )
+        self._db.commit()
+        return obj
+
+    def _forget(self, digest: str):
+        self._db.execute("DELETE FROM sources WHERE hash = ?", (digest,))
+        self._db.execute("DELETE FROM objects WHERE hash = ?", (digest,))
+        self._db.commit()
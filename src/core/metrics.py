@@ -0,0 +1,269 @@
+import asyncio
+import bisect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "anime_dl_"
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4**i for i in range(8))  # 64K/s to 1G/s
+# How often (in seconds) the JSON-lines exporter appends a snapshot
+EXPORT_INTERVAL = 10.0
+
+# name: (type, help, histogram buckets)
+FAMILIES: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "stage_seconds": (
+        "histogram",
+        "Duration of the scraping and post-processing stages (get_episodes is per listing page)",
+        SECONDS_BUCKETS,
+    ),
+    "head_seconds": ("histogram", "Latency of HEAD requests", SECONDS_BUCKETS),
+    "ttfb_seconds": (
+        "histogram",
+        "Time from sending a video GET to its response headers",
+        SECONDS_BUCKETS,
+    ),
+    "transfer_bytes_per_second": (
+        "histogram",
+        "Throughput of each video response body",
+        THROUGHPUT_BUCKETS,
+    ),
+    "retries_total": (
+        "counter",
+        "Downloads started again, by reason (expired, mirror, retry)",
+        (),
+    ),
+    "bytes_written_total": ("counter", "Bytes written to disk", ()),
+}
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).hostname or ""
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative until rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Timing:
+    """Outcome of a timed block, "ok" unless it raised or the caller set it."""
+
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+
+class Metrics:
+    """
+    In-process counters and histograms with labels, rendered in the
+    Prometheus text format or as JSON.
+
+    `counter` and `histogram` return the child for a set of labels, which
+    hot paths keep and update with a plain attribute add. Nothing is sent
+    anywhere unless an exporter is started.
+    """
+
+    def __init__(self):
+        self._children: Dict[str, Dict[Tuple[Tuple[str, str], ...], Any]] = {}
+
+    def _child(self, name: str, labels: Dict[str, str], factory):
+        family = self._children.setdefault(name, {})
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        child = family.get(key)
+        if child is None:
+            child = family[key] = factory()
+        return child
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self._child(name, labels, Counter)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        buckets = FAMILIES[name][2] if name in FAMILIES else SECONDS_BUCKETS
+        return self._child(name, labels, lambda: Histogram(buckets))
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[Timing]:
+        """
+        Observes the duration of the block in histogram `name`, with an
+        `outcome` label of "error" when it raises.
+        """
+        timing = Timing()
+        start = time.monotonic()
+        try:
+            yield timing
+        except BaseException:
+            timing.outcome = "error"
+            raise
+        finally:
+            self.histogram(name, outcome=timing.outcome, **labels).observe(
+                time.monotonic() - start
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        families = {}
+        for name, children in sorted(self._children.items()):
+            samples = []
+            for key, child in children.items():
+                sample: Dict[str, Any] = {"labels": dict(key)}
+                if isinstance(child, Histogram):
+                    sample.update(count=child.count, sum=child.sum)
+                    sample["buckets"] = dict(
+                        zip(
+                            [str(b) for b in child.buckets] + ["+Inf"],
+                            _cumulative(child.counts),
+                        )
+                    )
+                else:
+                    sample["value"] = child.value
+                samples.append(sample)
+            families[name] = samples
+        return {"time": time.time(), "metrics": families}
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, children in sorted(self._children.items()):
+            kind, help_text, _ = FAMILIES.get(name, ("untyped", "", ()))
+            full = PREFIX + name
+            if help_text:
+                lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for key, child in sorted(children.items()):
+                if isinstance(child, Histogram):
+                    bounds = [_format(b) for b in child.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, _cumulative(child.counts)):
+                        labels = _labels(key + (("le", bound),))
+                        lines.append(f"{full}_bucket{labels} {count}")
+                    lines.append(f"{full}_sum{_labels(key)} {_format(child.sum)}")
+                    lines.append(f"{full}_count{_labels(key)} {child.count}")
+                else:
+                    lines.append(f"{full}{_labels(key)} {_format(child.value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(key) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in key
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+# Registry shared by the whole process
+metrics = Metrics()
+
+
+class JsonLinesExporter:
+    """Appends a snapshot of the metrics to a file at a fixed interval."""
+
+    def __init__(
+        self,
+        path: str,
+        registry: Metrics = metrics,
+        interval: float = EXPORT_INTERVAL,
+    ):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def write(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.registry.snapshot()) + "\n")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.write()
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # The last line always holds the final numbers
+        self.write()
+
+
+class MetricsServer:
+    """Serves the metrics in the Prometheus text format on every GET."""
+
+    def __init__(self, host: str, port: int, registry: Metrics = metrics):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Only the request line matters, headers are read and dropped
+            while (await reader.readline()).strip():
+                pass
+            body = self.registry.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.debug(f"Metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
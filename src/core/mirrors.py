@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import time
+from typing import List
+
+from core.session import HttpSession
+
+logger = logging.getLogger(__name__)
+
+# Size and time budget of the throughput probe of each mirror
+PROBE_SIZE = 512 * 1024
+PROBE_TIMEOUT = 5.0
+
+
+async def probe(
+    session: HttpSession,
+    url: str,
+    size: int = PROBE_SIZE,
+    timeout: float = PROBE_TIMEOUT,
+) -> float:
+    """
+    Returns the throughput (bytes per second) of a short ranged read of
+    `url`, counting the time to first byte. A failed probe scores 0.
+    """
+    received = 0
+    start = time.monotonic()
+
+    async def read():
+        nonlocal received
+        headers = {"Range": f"bytes=0-{size - 1}"}
+        async with session.stream(
+            "GET", url, headers=headers, follow_redirects=True
+        ) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_raw():
+                received += len(chunk)
+                if received >= size:
+                    break
+
+    try:
+        await asyncio.wait_for(read(), timeout)
+    except asyncio.TimeoutError:
+        # A slow mirror is still ranked by what it managed to send
+        pass
+    except Exception as e:
+        logger.debug(f"Probe of {url} failed: {e}")
+        return 0.0
+    return received / max(time.monotonic() - start, 1e-6)
+
+
+async def rank_mirrors(session: HttpSession, urls: List[str]) -> List[str]:
+    """
+    Probes every direct URL at the same time and returns them fastest
+    first. Ties keep the given order.
+    """
+    if len(urls) < 2:
+        return list(urls)
+    speeds = await asyncio.gather(*(probe(session, url) for url in urls))
+    for url, speed in zip(urls, speeds):
+        logger.debug(f"Mirror {url}: {speed / 1024:.0f} KB/s")
+    order = sorted(range(len(urls)), key=lambda i: -speeds[i])
+    return [urls[i] for i in order]
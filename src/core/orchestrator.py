@@ -1,17 +1,50 @@
 import asyncio
 import logging
-from typing import List, Optional
+import os
+import time
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
+import httpx
+
+from core.adaptive import AdaptiveLimiter
 from core.base import BaseEpisode, Platform, VideoPlayer
-from core.downloader import SmartDownloader
+from core.cache import CacheStore, DirectUrlCache
+from core.downloader import SmartDownloader, episode_filename
+from core.integrity import Manifest, default_algorithm, hash_file
+from core.journal import COMPLETE, QUEUED, RESOLVED, Journal
+from core.library import LibraryStore
+from core.metrics import host_of, metrics
+from core.ratelimit import RateSchedule, TokenBucket
+from core.scheduling import FIFO, SMALLEST, EpisodeQueue, Priorities
 from core.config import SupportedPlayers
+from core.mirrors import rank_mirrors
+from core.postprocess import PostProcessor
+from core.session import HttpSession
+from core.writer import DEFAULT_BUFFER_SIZE
+from extractors.parsers import HtmlParser, get_parser
 from extractors.platforms.voiranime import VoirAnimePlatform
-from extractors.players.streamtape import StreamtapePlayer
+from extractors.players.registry import load_players
 from rich.console import Console
+from utils import aiterate, format_episodes, interleave
 
 logger = logging.getLogger(__name__)
 _console = Console()
 
+# A prefetched direct URL this close to `url_max_age`, in seconds, is
+# resolved again so it cannot expire right when its download starts
+PREFETCH_MARGIN = 60.0
+
 
 class Orchestrator:
     def __init__(
@@ -19,101 +52,712 @@ class Orchestrator:
         output_dir: str,
         max_concurrent: int = 3,
         player_code: str = SupportedPlayers.STREAMTAPE,
+        segments: int = 1,
+        max_resolvers: Optional[int] = None,
+        url_max_age: float = 600,
+        cache: Optional[CacheStore] = None,
+        parser: Optional[HtmlParser] = None,
+        max_per_host: Optional[int] = None,
+        adaptive: bool = False,
+        max_limit: int = 16,
+        limit_rate: Optional[float] = None,
+        episode_rate: Optional[float] = None,
+        rate_schedule: Optional[str] = None,
+        read_size: Optional[int] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        journal: bool = True,
+        checksum: bool = True,
+        race: bool = True,
+        library: Optional[LibraryStore] = None,
+        postprocessor: Optional[PostProcessor] = None,
+        order: str = FIFO,
+        prefetch: bool = False,
     ):
         self.output_dir = output_dir
+        self.max_concurrent = max_concurrent
         self.semaphore = asyncio.Semaphore(max_concurrent)
+        # Scraping has its own limit so it never waits behind byte transfers
+        self.max_resolvers = max_resolvers or max_concurrent
+        self.resolve_semaphore = asyncio.Semaphore(self.max_resolvers)
+        # Gate of the download stage. With `adaptive` its limit moves between 1
+        # and `max_limit` with the measured throughput, otherwise it stays fixed.
+        self.adaptive = adaptive
+        self.limiter = AdaptiveLimiter(
+            max_concurrent, maximum=max_limit if adaptive else max_concurrent
+        )
+        # Bandwidth shared by all downloads, optionally driven by a schedule file
+        self.rate_limit = TokenBucket(limit_rate)
+        self.episode_rate = episode_rate
+        self.rate_schedule = (
+            RateSchedule(rate_schedule, self.rate_limit) if rate_schedule else None
+        )
+        # Size of the chunks read from responses, None for socket-sized ones
+        self.read_size = read_size
+        self.buffer_size = buffer_size
+        # Direct URLs older than this (in seconds) are resolved again before use
+        self.url_max_age = url_max_age
         self.player_code = player_code
+        self.segments = segments
 
-        # Registry of available platforms and players
-        self.platform: Platform = VoirAnimePlatform(preferred_player=player_code)
+        # One pooled client shared by every platform, player and downloader.
+        # HTTP/2 is turned off for segmented downloads, which rely on separate
+        # connections to get around per-connection throttling.
+        transfers = (max_limit if adaptive else max_concurrent) * segments
+        per_host = max_per_host or max(8, transfers)
+        # The pool fits every transfer plus the pages scraped meanwhile, so
+        # no request holding a host slot waits for a pooled connection
+        self.session = HttpSession(
+            max_connections=max(32, transfers + per_host),
+            max_keepalive=max(16, per_host),
+            max_per_host=per_host,
+            http2=segments <= 1,
+        )
+
+        # One job journal per output directory, opened on first use
+        self.use_journal = journal
+        self.journals: Dict[str, Journal] = {}
+        # Finished files are hashed while downloading and listed in a manifest
+        self.checksum = checksum
+        self.manifests: Dict[str, Manifest] = {}
+        # Optional content-addressed store the series folders link into
+        self.library = library if library is not None else LibraryStore()
+        # Steps run on finished files in a process pool, while the next
+        # episodes download. The tasks are awaited before returning results.
+        self.postprocessor = postprocessor
+        self._post_tasks: Set[asyncio.Task] = set()
+        # Which waiting episode starts first and which running download gets
+        # the bandwidth first (under a rate limit), see core.scheduling
+        self.priorities = Priorities(order)
+        # With `prefetch`, the next queued episode gets its HEAD request (and
+        # a warm connection) while the end of a download is still arriving
+        self.prefetch = prefetch
 
-        # Load available players
-        # Ideally this should be dynamic, but for now we register manually
-        self.players: List[VideoPlayer] = []
+        # Scraped pages are cached on disk unless a disabled store is given
+        self.cache = cache if cache is not None else CacheStore.default()
+        # Direct URLs are reused until they expire, across retries and runs
+        self.direct_urls = DirectUrlCache(self.cache, default_ttl=url_max_age)
 
-        # Register Streamtape player
-        if player_code == SupportedPlayers.STREAMTAPE:
-            self.players.append(StreamtapePlayer())
-        # Add other players here if selected
+        self.parser = parser or get_parser()
 
-        if not self.players:
+        # Registry of available platforms and players
+        self.platform: Platform = VoirAnimePlatform(
+            self.session,
+            preferred_player=player_code,
+            cache=self.cache,
+            parser=self.parser,
+        )
+
+        # Built-in players and those installed as plugins (entry points)
+        players = load_players()
+        self.players: List[VideoPlayer] = [
+            cls(self.session) for cls in players.values()
+        ]
+        # With `race`, every mirror with a known player is resolved and probed
+        # and the fastest one is used, otherwise only the selected player
+        self.race = race
+
+        if player_code not in players:
             logger.warning(f"No player implementation found for code: {player_code}")
 
-    async def get_series_episodes(self, url: str) -> List[BaseEpisode]:
+    async def __aenter__(self):
+        await self.session.open()
+        if self.rate_schedule:
+            self.rate_schedule.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.rate_schedule:
+            await self.rate_schedule.stop()
+        await self.session.close()
+        if self.postprocessor:
+            self.postprocessor.close()
+        self.cache.close()
+        self.library.close()
+        for journal in self.journals.values():
+            journal.close()
+
+    async def get_series_episodes(
+        self, url: str, ttl: Optional[float] = None
+    ) -> List[BaseEpisode]:
         """
         Fetches episodes from the configured platform.
         """
-        return await self.platform.get_episodes(url)
+        return await self.platform.get_episodes(url, ttl)
+
+    def iter_series_episodes(
+        self, url: str, ttl: Optional[float] = None
+    ) -> AsyncIterator[BaseEpisode]:
+        """
+        Yields episodes from the configured platform as they are found.
+        """
+        return self.platform.iter_episodes(url, ttl)
+
+    def boost(self, ranges: List[Tuple[float, float]], value: float = 1.0):
+        """
+        Moves episodes (by number, see `utils.parse_episodes`) ahead of the
+        others. Applies at once to waiting episodes and running downloads.
+        """
+        self.priorities.boost(ranges, value)
+        logger.info(f"Boost of episodes {format_episodes(ranges)} set to {value:g}")
 
     async def download_episode(self, episode: BaseEpisode, progress=None) -> bool:
         """
         Orchestrates the download of a single episode.
         """
-        current_console = progress.console if progress else _console
+        self._journal(episode).claim(episode.number, episode.url)
+        if self._is_complete(episode, progress) or self._from_library(
+            episode, progress
+        ):
+            return True
         async with self.semaphore:
             try:
-                # 1. Get player URL
-                status = current_console.status(
+                direct_urls = await self._resolve(episode, progress)
+                if not direct_urls:
+                    return False
+                ok = await self._download(episode, direct_urls, progress)
+                await self._wait_post_processing()
+                return ok
+            except Exception as e:
+                logger.error(f"Failed to download {episode.name}: {e}", exc_info=True)
+                return False
+
+    async def download_episodes(
+        self,
+        episodes: Union[Iterable[BaseEpisode], AsyncIterable[BaseEpisode]],
+        progress=None,
+    ) -> List[bool]:
+        """
+        Downloads several episodes as a two-stage pipeline.
+
+        Resolver workers turn episodes into direct URLs and push them to a
+        bounded queue, download workers drain it. The queue only holds a
+        handful of URLs so signed links are not resolved long before use.
+        Both queues hand out the episode going first by `priorities`.
+
+        `episodes` may be an async iterator (see `iter_series_episodes`). In
+        fifo order it is only read as resolvers need work, so downloads start
+        while a long listing is still being parsed and few episodes are held
+        at a time. Other orders read it whole, so they can pick among all
+        episodes. Results are in the order episodes were read.
+        """
+        results: List[bool] = []
+        priorities = self.priorities
+        todo: EpisodeQueue = EpisodeQueue(
+            lambda item: priorities.queue_key(item[1].number, item[0], item[2]),
+            maxsize=0 if priorities.active else self.max_resolvers,
+        )
+        ready: EpisodeQueue = EpisodeQueue(
+            lambda item: priorities.queue_key(item[1].number, item[0], item[4]),
+            maxsize=self.max_concurrent,
+        )
+
+        async def feed():
+            async for episode in aiterate(episodes):
+                journal = self._journal(episode)
+                journal.claim(episode.number, episode.url)
+                results.append(False)
+                size = (journal.get(episode.number) or {}).get("size")
+                await todo.put((len(results) - 1, episode, size))
+            await todo.close()
+
+        # Prefetch tasks of queued episodes, by index
+        prefetched: Dict[int, asyncio.Future] = {}
+        # Set when a download neared its end with no episode ready yet
+        wanted = False
+
+        def prefetch_next():
+            nonlocal wanted
+            item = ready.peek()
+            wanted = item is None
+            if item is None or item[0] in prefetched:
+                return
+            index, episode, direct_urls, resolved_at, _ = item
+            prefetched[index] = asyncio.ensure_future(
+                self._prefetch(episode, direct_urls, resolved_at, progress)
+            )
+
+        async def resolve_worker():
+            while True:
+                item = await todo.get()
+                if item is None:
+                    return
+                index, episode, size = item
+                if self._is_complete(episode, progress) or self._from_library(
+                    episode, progress
+                ):
+                    results[index] = True
+                    continue
+                try:
+                    direct_urls = await self._resolve(episode, progress)
+                except Exception as e:
+                    logger.error(
+                        f"Failed to resolve {episode.name}: {e}", exc_info=True
+                    )
+                    direct_urls = []
+                if not direct_urls:
+                    continue
+                resolved_at = time.monotonic() - self._url_age(episode)
+                if size is None and priorities.order == SMALLEST:
+                    size = await self._probe_size(direct_urls[0])
+                await ready.put((index, episode, direct_urls, resolved_at, size))
+                if wanted:
+                    prefetch_next()
+
+        async def download_worker():
+            while True:
+                item = await ready.get()
+                if item is None:
+                    return
+                index, episode, direct_urls, resolved_at, _ = item
+                # The slot is taken once there is work, so the limiter only
+                # counts workers that are transferring
+                async with self.limiter:
+                    head = None
+                    try:
+                        if index in prefetched:
+                            direct_urls, resolved_at, head = await prefetched.pop(index)
+                        if time.monotonic() - resolved_at > self.url_max_age:
+                            logger.debug(
+                                f"Direct URL for {episode.name} expired, resolving again"
+                            )
+                            direct_urls = await self._resolve(episode, progress)
+                            # The prefetched HEAD describes the old URL
+                            head = None
+                        results[index] = bool(direct_urls) and await self._download(
+                            episode,
+                            direct_urls,
+                            progress,
+                            head=head,
+                            on_tail=prefetch_next if self.prefetch else None,
+                        )
+                    except Exception as e:
+                        logger.error(
+                            f"Failed to download {episode.name}: {e}", exc_info=True
+                        )
+
+        feeder = asyncio.ensure_future(feed())
+        resolvers = [
+            asyncio.ensure_future(resolve_worker()) for _ in range(self.max_resolvers)
+        ]
+        downloaders = [
+            asyncio.ensure_future(download_worker())
+            for _ in range(self.limiter.maximum)
+        ]
+        if self.adaptive:
+            self.limiter.start(progress)
+        try:
+            await asyncio.gather(feeder, *resolvers)
+            await ready.close()
+            await asyncio.gather(*downloaders)
+            await self._wait_post_processing()
+        finally:
+            tasks = [feeder] + resolvers + downloaders + list(prefetched.values())
+            for task in tasks:
+                task.cancel()
+            # A job resumed right after a cancel must not overlap writers
+            # still unwinding here
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.limiter.stop()
+
+        return results
+
+    async def download_batch(
+        self, groups: List[List[BaseEpisode]], progress=None
+    ) -> List[bool]:
+        """
+        Downloads the episodes of several series through a single pipeline.
+
+        Episodes are taken from each series in turn, so one long series
+        cannot keep the others waiting.
+        """
+        return await self.download_episodes(interleave(groups), progress)
+
+    async def _resolve(
+        self, episode: BaseEpisode, progress=None, refresh: bool = False
+    ) -> List[str]:
+        """
+        Scrapes the episode page and the player pages to get direct video URLs,
+        fastest mirror first.
+
+        A URL resolved by an earlier run is reused while younger than
+        `url_max_age`, unless `refresh` asks for a new one (e.g. after a 403)
+        or the cache is refreshing everything (`--refresh`).
+        """
+        journal = self._journal(episode)
+        entry = journal.get(episode.number)
+        if (
+            not refresh
+            and not self.cache.refresh
+            and entry
+            and entry["direct_url"]
+            and self._url_age(episode) < self.url_max_age
+        ):
+            logger.debug(f"Reusing the journaled direct URL of {episode.name}")
+            return [entry["direct_url"]]
+
+        async with self.resolve_semaphore:
+            # 1. Get player URL
+            if progress:
+                row = progress.add(
+                    f"[bold]Fetching player URL for {episode.name}...[/]"
+                )
+            else:
+                status = _console.status(
                     f"[bold]Fetching player URL for {episode.name}...[/]"
                 )
                 status.start()
-                player_url = await episode.get_player_url()
-                if not player_url:
+            try:
+                with metrics.timer(
+                    "stage_seconds", stage="get_player_url", host=host_of(episode.url)
+                ) as timing:
+                    if self.race:
+                        player_urls = await episode.get_mirror_urls()
+                    else:
+                        player_url = await episode.get_player_url()
+                        player_urls = [player_url] if player_url else []
+                    if not player_urls:
+                        timing.outcome = "empty"
+                # Mirrors hosted by a player we do not know are left out
+                player_urls = [url for url in player_urls if self._player_for(url)]
+                if not player_urls:
                     logger.error(f"Could not find player URL for {episode.name}")
-                    status.stop()
-                    return False
+                    return []
 
-                status.update(f"[bold]Extracting direct URL for {episode.name}...[/]")
-                # 2. Find compatible player and extract direct URL
-                direct_url = await self._extract_direct_url(player_url)
-                if not direct_url:
+                description = f"[bold]Extracting direct URL for {episode.name}...[/]"
+                if len(player_urls) > 1:
+                    description = f"[bold]Racing {len(player_urls)} mirrors for {episode.name}...[/]"
+                if progress:
+                    row.description = description
+                else:
+                    status.update(description)
+                # 2. Resolve every mirror at once, then rank them by a short probe
+                resolved = await asyncio.gather(
+                    *(self._extract_direct_url(url, refresh) for url in player_urls),
+                    return_exceptions=True,
+                )
+                direct_urls = await rank_mirrors(
+                    self.session, [url for url in resolved if isinstance(url, str)]
+                )
+                if not direct_urls:
                     logger.error(
-                        f"Could not extract direct URL for {episode.name} from {player_url}"
+                        f"Could not extract direct URL for {episode.name} from {player_urls}"
                     )
+                    return []
+
+                fields = {"direct_url": direct_urls[0], "resolved_at": time.time()}
+                # A started download keeps its state, see SmartDownloader.download
+                if entry is None or entry["state"] == QUEUED:
+                    fields["state"] = RESOLVED
+                journal.update(episode.number, url=episode.url, **fields)
+                return direct_urls
+            finally:
+                if progress:
+                    progress.remove(row)
+                else:
                     status.stop()
-                    return False
-                status.stop()
 
-                # 3. Download
-                downloader = SmartDownloader(self.output_dir)
-                path, skipped = await downloader.download(
-                    direct_url, episode.number, progress
+    async def _download(
+        self,
+        episode: BaseEpisode,
+        direct_urls: List[str],
+        progress=None,
+        head: Optional[httpx.Response] = None,
+        on_tail: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        async def refresh_url():
+            urls = await self._resolve(episode, progress, refresh=True)
+            return urls[0] if urls else None
+
+        journal = self._journal(episode)
+        manifest = self._manifest(episode)
+        downloader = SmartDownloader(
+            self.session,
+            episode.output_dir or self.output_dir,
+            segments=self.segments,
+            monitor=self.limiter,
+            rate_limit=self.rate_limit,
+            episode_rate=self.episode_rate,
+            read_size=self.read_size,
+            buffer_size=self.buffer_size,
+            journal=journal.entry(episode.number),
+            checksum=manifest.algorithm if manifest else None,
+            refresh_url=refresh_url,
+            mirrors=direct_urls[1:],
+            library=self.library if self.library.enabled else None,
+            priority=lambda remaining: self.priorities.bandwidth_key(
+                episode.number, remaining
+            ),
+            head=head,
+            on_tail=on_tail,
+        )
+        path, skipped = await downloader.download(
+            direct_urls[0], episode.number, progress
+        )
+
+        # Only a file with the announced size is recorded as complete
+        size = os.path.getsize(path)
+        expected = (journal.get(episode.number) or {}).get("size")
+        if expected is not None and size != expected:
+            logger.error(
+                f"{episode.name} is {size} bytes, expected {expected}, will retry next run"
+            )
+            return False
+        journal.update(
+            episode.number,
+            state=COMPLETE,
+            path=path,
+            size=size,
+            bytes_done=size,
+            verified=int(expected is not None),
+        )
+        sources = [episode.url, direct_urls[0]]
+        if self.postprocessor and not downloader.linked:
+            # The manifest and library get the file once its steps are done
+            self._start_post_processing(
+                episode, path, sources, downloader.digest, manifest, progress
+            )
+        else:
+            if manifest and downloader.digest:
+                manifest.set(os.path.basename(path), size, downloader.digest)
+            if self.library.enabled and not downloader.linked:
+                await self._store_in_library(path, sources, downloader.digest, manifest)
+
+        if downloader.linked:
+            if progress:
+                progress.console.print(
+                    f"[green]✔[/] {episode.name} linked from the library."
                 )
+            else:
+                logger.info(f"Linked {episode.name} from the library: {path}")
+        elif skipped:
+            if progress:
+                progress.console.print(f"[yellow]⚠[/] {episode.name} already exists.")
+            else:
+                logger.info(f"Skipped {episode.name} (already exists): {path}")
+        else:
+            if progress:
+                progress.console.print(f"[green]✔[/] {episode.name} finished.")
+            else:
+                logger.info(f"Downloaded {episode.name}: {path}")
 
-                if skipped:
-                    if progress:
-                        progress.console.print(
-                            f"[yellow]⚠[/] {episode.name} already exists."
-                        )
-                    else:
-                        logger.info(f"Skipped {episode.name} (already exists): {path}")
-                else:
-                    if progress:
-                        progress.console.print(f"[green]✔[/] {episode.name} finished.")
-                    else:
-                        logger.info(f"Downloaded {episode.name}: {path}")
+        return True
 
-                return True
+    async def _prefetch(
+        self,
+        episode: BaseEpisode,
+        direct_urls: List[str],
+        resolved_at: float,
+        progress=None,
+    ) -> Tuple[List[str], float, Optional[httpx.Response]]:
+        """
+        Gets a queued episode ready while the previous download ends: a
+        direct URL that will not expire before use and its HEAD response,
+        which leaves a warm connection to the video host in the pool.
+        Returns the direct URLs, when they were resolved and the response.
+        """
+        try:
+            if time.monotonic() - resolved_at > self.url_max_age - PREFETCH_MARGIN:
+                direct_urls = await self._resolve(episode, progress, refresh=True)
+                resolved_at = time.monotonic()
+            if not direct_urls:
+                return direct_urls, resolved_at, None
+            url = direct_urls[0]
+            await self.session.retry.wait(url)
+            with metrics.timer("head_seconds", host=host_of(url)) as timing:
+                head = await self.session.head(url, follow_redirects=True)
+                timing.outcome = str(head.status_code)
+            logger.debug(f"Prefetched {episode.name}")
+            return direct_urls, resolved_at, head
+        except Exception as e:
+            # The download does the same requests itself
+            logger.debug(f"Could not prefetch {episode.name}: {e}")
+            return direct_urls, resolved_at, None
 
-            except Exception as e:
-                logger.error(f"Failed to download {episode.name}: {e}", exc_info=True)
-                return False
+    async def _probe_size(self, url: str) -> Optional[int]:
+        """Size of a video from a HEAD request, None when unknown."""
+        try:
+            r = await self.session.head(url, follow_redirects=True)
+            size = int(r.headers.get("Content-Length", 0)) if r.is_success else 0
+        except Exception as e:
+            logger.debug(f"Could not get the size of {url}: {e}")
+            return None
+        return size or None
 
-    async def _extract_direct_url(self, player_url: str) -> Optional[str]:
+    def _start_post_processing(
+        self,
+        episode: BaseEpisode,
+        path: str,
+        sources: List[str],
+        digest: Optional[str],
+        manifest: Optional[Manifest],
+        progress=None,
+    ):
+        task = asyncio.ensure_future(
+            self._post_process(episode, path, sources, digest, manifest, progress)
+        )
+        self._post_tasks.add(task)
+        task.add_done_callback(self._post_tasks.discard)
+
+    async def _wait_post_processing(self):
+        while self._post_tasks:
+            await asyncio.gather(*self._post_tasks)
+
+    async def _post_process(
+        self,
+        episode: BaseEpisode,
+        path: str,
+        sources: List[str],
+        digest: Optional[str],
+        manifest: Optional[Manifest],
+        progress=None,
+    ):
         """
-        Iterates through registered players to find one that can handle the URL.
+        Runs the post-processing steps on a downloaded episode, then records
+        the resulting file in the journal, manifest and library. A failed
+        step leaves the file as downloaded.
         """
-        for player in self.players:
-            # We check if the player name matches the preference or if it can handle the URL
-            # For now, simple check based on URL content vs player type
-            if (
-                isinstance(player, StreamtapePlayer)
-                and "streamtape" in player_url.lower()
-            ):
-                return await player.extract_direct_url(player_url)
-            # Future players logic
-
-        logger.warning(
-            f"No suitable player found for URL: {player_url} (Configured player: {self.player_code})"
+        source_size = os.path.getsize(path)
+        algorithm = manifest.algorithm if manifest else default_algorithm()
+        if progress:
+            row = progress.add(f"[bold]Post-processing {episode.name}...[/]")
+        try:
+            with metrics.timer("stage_seconds", stage="postprocess", host=""):
+                result = await self.postprocessor.run(path, algorithm)
+        except Exception as e:
+            logger.error(f"Post-processing of {episode.name} failed: {e}")
+            result = None
+        finally:
+            if progress:
+                progress.remove(row)
+
+        size = source_size
+        if result:
+            size, digest = result["size"], result["hash"]
+            # The journal checks the size of complete files on restart
+            self._journal(episode).update(episode.number, size=size, bytes_done=size)
+        if manifest and digest:
+            manifest.set(os.path.basename(path), size, digest)
+        if self.library.enabled:
+            await self._store_in_library(path, sources, digest, manifest, source_size)
+
+    async def _store_in_library(
+        self,
+        path: str,
+        sources: List[str],
+        digest: Optional[str],
+        manifest: Optional[Manifest],
+        source_size: Optional[int] = None,
+    ):
+        algorithm = manifest.algorithm if manifest else default_algorithm()
+        try:
+            if not digest:
+                # Skipped files and --no-checksum runs have no streaming hash
+                digest = await asyncio.get_running_loop().run_in_executor(
+                    None, hash_file, path, algorithm
+                )
+            self.library.add(path, sources, digest, algorithm, source_size)
+        except OSError as e:
+            logger.warning(f"Could not add {path} to the library: {e}")
+
+    def _from_library(self, episode: BaseEpisode, progress=None) -> bool:
+        """
+        Links an episode already in the library into its folder, without any
+        request.
+        """
+        obj = self.library.lookup(episode.url)
+        if obj is None:
+            return False
+        output_dir = episode.output_dir or self.output_dir
+        path = os.path.join(output_dir, episode_filename(output_dir, episode.number))
+        try:
+            self.library.link(obj, path)
+        except OSError as e:
+            logger.warning(f"Could not link {episode.name} from the library: {e}")
+            return False
+        self._journal(episode).update(
+            episode.number,
+            url=episode.url,
+            state=COMPLETE,
+            path=path,
+            size=obj["size"],
+            bytes_done=obj["size"],
+            verified=1,
         )
+        manifest = self._manifest(episode)
+        if manifest and manifest.algorithm == obj["algorithm"]:
+            manifest.set(os.path.basename(path), obj["size"], obj["hash"])
+        if progress:
+            progress.console.print(
+                f"[green]✔[/] {episode.name} linked from the library."
+            )
+        else:
+            logger.info(f"Linked {episode.name} from the library: {path}")
+        return True
+
+    def _journal(self, episode: BaseEpisode) -> Journal:
+        output_dir = episode.output_dir or self.output_dir
+        if not self.use_journal:
+            return Journal()
+        if output_dir not in self.journals:
+            self.journals[output_dir] = Journal.for_dir(output_dir)
+        return self.journals[output_dir]
+
+    def _manifest(self, episode: BaseEpisode) -> Optional[Manifest]:
+        if not self.checksum:
+            return None
+        output_dir = episode.output_dir or self.output_dir
+        if output_dir not in self.manifests:
+            self.manifests[output_dir] = Manifest.for_dir(output_dir)
+        return self.manifests[output_dir]
+
+    def _url_age(self, episode: BaseEpisode) -> float:
+        """Seconds since the journaled direct URL of an episode was resolved."""
+        entry = self._journal(episode).get(episode.number)
+        if entry is None or entry["resolved_at"] is None:
+            return 0.0
+        return max(0.0, time.time() - entry["resolved_at"])
+
+    def _is_complete(self, episode: BaseEpisode, progress=None) -> bool:
+        """Checks the journal, without any request, for a finished episode."""
+        if not self._journal(episode).is_complete(episode.number, episode.url):
+            return False
+        if progress:
+            progress.console.print(f"[yellow]⚠[/] {episode.name} already complete.")
+        else:
+            logger.info(f"Skipped {episode.name} (complete in journal)")
+        return True
+
+    def _player_for(self, player_url: str) -> Optional[VideoPlayer]:
+        """Returns the first registered player that handles the URL."""
+        for player in self.players:
+            if player.handles(player_url):
+                return player
         return None
+
+    async def _extract_direct_url(
+        self, player_url: str, refresh: bool = False
+    ) -> Optional[str]:
+        """
+        Uses the registered player that handles the URL to get its direct link.
+        """
+        if not refresh:
+            cached = self.direct_urls.get(player_url)
+            if cached:
+                return cached
+
+        player = self._player_for(player_url)
+        if player is None:
+            logger.warning(
+                f"No suitable player found for URL: {player_url} (Configured player: {self.player_code})"
+            )
+            return None
+
+        with metrics.timer(
+            "stage_seconds", stage="extract_direct_url", host=host_of(player_url)
+        ) as timing:
+            direct_url = await player.extract_direct_url(player_url)
+            if not direct_url:
+                timing.outcome = "empty"
+        if direct_url:
+            self.direct_urls.set(player_url, direct_url)
+        return direct_url
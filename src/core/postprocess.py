@@ -0,0 +1,286 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from core.integrity import hash_file
+from utils import load_entry_points
+
+# Entry point group third-party packages use to add steps, e.g. in their
+# pyproject.toml: [project.entry-points."anime_dl.postprocess"] subs = "pkg:extract_subs"
+ENTRY_POINT_GROUP = "anime_dl.postprocess"
+DEFAULT_JOBS = 2
+# Position of the thumbnail frame, in seconds (the start is often a black frame)
+THUMBNAIL_OFFSET = 30
+COPY_SIZE = 1024 * 1024
+
+# Boxes on the path from moov to the chunk offset tables
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+# A step takes the path of a finished video and returns True when it
+# changed the file. Steps run in worker processes, so they must be
+# importable top-level functions.
+Step = Callable[[str], bool]
+
+
+def _boxes(f, start: int, end: int):
+    """Yields (type, offset, size, header size) of the boxes in [start, end)."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", f.read(8))
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ValueError(f"Invalid {kind!r} box at offset {offset}")
+        yield kind, offset, size, header
+        offset += size
+
+
+def _patch_offsets(data: bytes, shift: Callable[[int], int], co64: bool) -> bytes:
+    """
+    Rebuilds the children of a box with every chunk offset moved by
+    `shift`, turning 32-bit tables (stco) into 64-bit ones (co64) if asked.
+    """
+    out = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, offset + 8)
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        body = data[offset + header : offset + size]
+        if kind in _CONTAINERS:
+            body = _patch_offsets(body, shift, co64)
+        elif kind in (b"stco", b"co64"):
+            (count,) = struct.unpack_from(">I", body, 4)
+            width = "I" if kind == b"stco" else "Q"
+            entries = [
+                shift(o) for o in struct.unpack_from(f">{count}{width}", body, 8)
+            ]
+            if kind == b"stco" and not co64:
+                if entries and max(entries) > 0xFFFFFFFF:
+                    raise OverflowError("Chunk offsets no longer fit in 32 bits")
+            else:
+                kind, width = b"co64", "Q"
+            body = body[:8] + struct.pack(f">{count}{width}", *entries)
+        out.append(struct.pack(">I4s", len(body) + 8, kind) + body)
+        offset += size
+    return b"".join(out)
+
+
+def _copy_range(src, dst, start: int, end: int):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = src.read(min(COPY_SIZE, remaining))
+        if not chunk:
+            raise ValueError("Unexpected end of file")
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def faststart(path: str) -> bool:
+    """
+    Moves the moov box in front of the media data, so players can seek
+    before the whole file is read. Pure Python: the chunk offset tables are
+    rewritten and the file is copied once. Files that are already laid out
+    this way, fragmented or not MP4 are left alone.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        try:
+            boxes = list(_boxes(f, 0, file_size))
+        except (ValueError, struct.error):
+            return False
+        kinds = [kind for kind, *_ in boxes]
+        if b"moov" not in kinds or b"mdat" not in kinds or b"moof" in kinds:
+            return False
+        _, moov_start, moov_size, moov_header = boxes[kinds.index(b"moov")]
+        mdat_start = boxes[kinds.index(b"mdat")][1]
+        if moov_start < mdat_start:
+            return False
+
+        f.seek(moov_start + moov_header)
+        body = f.read(moov_size - moov_header)
+        moov_end = moov_start + moov_size
+
+        def build(co64: bool) -> bytes:
+            # The new size only depends on co64, so measure it first
+            grown = len(_patch_offsets(body, lambda o: o, co64)) + 8
+
+            def shift(o):
+                if o >= moov_end:
+                    return o + grown - moov_size
+                return o + grown if o >= mdat_start else o
+
+            return struct.pack(">I4s", grown, b"moov") + _patch_offsets(
+                body, shift, co64
+            )
+
+        try:
+            moov = build(co64=False)
+        except OverflowError:
+            moov = build(co64=True)
+
+        tmp_path = path + ".faststart"
+        try:
+            with open(tmp_path, "wb") as out:
+                _copy_range(f, out, 0, mdat_start)
+                out.write(moov)
+                _copy_range(f, out, mdat_start, moov_start)
+                _copy_range(f, out, moov_end, file_size)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    # A new file, so hardlinks to the old one (see core.library) keep their bytes
+    os.replace(tmp_path, path)
+    return True
+
+
+def _ffmpeg(*args: str):
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-nostdin", "-y", *args],
+        check=True,
+        capture_output=True,
+    )
+
+
+def remux(path: str) -> bool:
+    """Rewrites the container with ffmpeg (streams copied) and faststart."""
+    tmp_path = path + ".remux.mp4"
+    try:
+        _ffmpeg(
+            "-i", path, "-map", "0", "-c", "copy", "-movflags", "+faststart", tmp_path
+        )
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return True
+
+
+def thumbnail(path: str) -> bool:
+    """Saves a frame as "<name>-thumb.jpg" next to the video, as media servers expect."""
+    target = os.path.splitext(path)[0] + "-thumb.jpg"
+    # Videos shorter than the offset get their first frame
+    for offset in (THUMBNAIL_OFFSET, 0):
+        try:
+            _ffmpeg(
+                "-ss",
+                str(offset),
+                "-i",
+                path,
+                "-vf",
+                "thumbnail,scale=480:-2",
+                "-frames:v",
+                "1",
+                target,
+            )
+        except subprocess.CalledProcessError:
+            if not offset:
+                raise
+        if os.path.exists(target):
+            break
+    return False
+
+
+STEPS: Dict[str, Step] = {
+    "faststart": faststart,
+    "remux": remux,
+    "thumbnail": thumbnail,
+}
+# Steps that run the ffmpeg executable
+FFMPEG_STEPS = {"remux", "thumbnail"}
+
+
+def register_step(name: str):
+    """
+    Adds a step to the registry. Usable as a function decorator. Workers
+    only see steps from modules they import, so plugins should rather use
+    the entry point group.
+    """
+
+    def decorator(step: Step) -> Step:
+        STEPS[name] = step
+        return step
+
+    return decorator
+
+
+def load_steps() -> Dict[str, Step]:
+    """
+    Returns the built-in steps plus those installed through entry points.
+    A plugin that fails to load is skipped with a warning.
+    """
+    for name, step in load_entry_points(ENTRY_POINT_GROUP):
+        STEPS.setdefault(name, step)
+    return STEPS
+
+
+def check_steps(names: List[str]) -> List[str]:
+    """Raises ValueError for unknown steps, or ffmpeg steps without ffmpeg."""
+    steps = load_steps()
+    unknown = [name for name in names if name not in steps]
+    if unknown:
+        raise ValueError(
+            f"Unknown post-processing step '{unknown[0]}' (available: {', '.join(steps)})"
+        )
+    if FFMPEG_STEPS.intersection(names) and shutil.which("ffmpeg") is None:
+        raise ValueError("ffmpeg is required by remux and thumbnail but was not found")
+    return names
+
+
+def run_steps(path: str, names: List[str], algorithm: str) -> Optional[Dict]:
+    """
+    Runs the steps on a file, in a worker process. Returns the new size and
+    hash when a step changed the file, else None.
+    """
+    steps = load_steps()
+    changed = False
+    for name in names:
+        changed = steps[name](path) or changed
+    if not changed:
+        return None
+    return {"size": os.path.getsize(path), "hash": hash_file(path, algorithm)}
+
+
+class PostProcessor:
+    """
+    Runs post-download steps on a bounded pool of processes, so remuxing,
+    rewriting and hashing videos overlap with the next downloads and never
+    block the event loop.
+    """
+
+    def __init__(self, steps: List[str], jobs: int = DEFAULT_JOBS):
+        self.steps = check_steps(list(steps))
+        self.jobs = max(1, jobs)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def run(self, path: str, algorithm: str) -> Optional[Dict]:
+        """Processes one file, see `run_steps`."""
+        if self._pool is None:
+            # Spawned workers: forking a process with running threads is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.jobs, mp_context=multiprocessing.get_context("spawn")
+            )
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool, run_steps, path, self.steps, algorithm
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
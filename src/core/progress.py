@@ -0,0 +1,128 @@
+import asyncio
+from typing import List, Optional, Set
+
+from rich.console import Console
+from rich.progress import (
+    Progress,
+    SpinnerColumn,
+    BarColumn,
+    TextColumn,
+    DownloadColumn,
+    TransferSpeedColumn,
+    TimeRemainingColumn,
+)
+
+# How often (in seconds) the counters are copied into the display
+DEFAULT_REFRESH_INTERVAL = 0.25
+
+
+def make_progress(console: Console) -> Progress:
+    return Progress(
+        SpinnerColumn(),
+        TextColumn("{task.description}"),
+        BarColumn(),
+        DownloadColumn(),
+        TransferSpeedColumn(),
+        TimeRemainingColumn(),
+        console=console,
+    )
+
+
+class Transfer:
+    """
+    Counters of one progress row. The data path only bumps plain attributes,
+    the tracker copies them into the display.
+    """
+
+    __slots__ = ("description", "total", "completed", "task_id")
+
+    def __init__(self, description: str, total: Optional[int], completed: int):
+        self.description = description
+        self.total = total
+        self.completed = completed
+        self.task_id = None
+
+
+class ProgressTracker:
+    """
+    Renders Transfer counters into a rich Progress at a fixed refresh rate.
+
+    Without a Progress (quiet mode) counters are still kept but nothing is
+    drawn, and messages still go to the console.
+    """
+
+    def __init__(
+        self,
+        progress: Optional[Progress] = None,
+        console: Optional[Console] = None,
+        interval: float = DEFAULT_REFRESH_INTERVAL,
+    ):
+        self.progress = progress
+        self.console = console or (progress.console if progress else Console())
+        self.interval = interval
+        self._transfers: Set[Transfer] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(
+        self, description: str, total: Optional[int] = None, completed: int = 0
+    ) -> Transfer:
+        transfer = Transfer(description, total, completed)
+        if self.progress:
+            transfer.task_id = self.progress.add_task(
+                description, total=total, completed=completed
+            )
+        self._transfers.add(transfer)
+        return transfer
+
+    def finish(self, transfer: Transfer):
+        """Stops sampling a transfer, its row stays with the final values."""
+        self._render(transfer)
+        self._transfers.discard(transfer)
+
+    def remove(self, transfer: Transfer):
+        """Stops sampling a transfer and removes its row."""
+        self._transfers.discard(transfer)
+        if self.progress and transfer.task_id is not None:
+            self.progress.remove_task(transfer.task_id)
+
+    def _render(self, transfer: Transfer):
+        if self.progress and transfer.task_id is not None:
+            self.progress.update(
+                transfer.task_id,
+                description=transfer.description,
+                total=transfer.total,
+                completed=transfer.completed,
+            )
+
+    def transfers(self) -> List[Transfer]:
+        """Rows currently sampled, e.g. to report them somewhere else."""
+        return list(self._transfers)
+
+    def refresh(self):
+        for transfer in list(self._transfers):
+            self._render(transfer)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.refresh()
+
+    def start(self):
+        if self.progress:
+            self.progress.start()
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.refresh()
+        if self.progress:
+            self.progress.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from utils import parse_rate
+
+logger = logging.getLogger(__name__)
+
+# How long a turn waits for the download of higher priority that just had
+# it (reading its next chunk) before going to one of lower priority
+HAND_OVER_GRACE = 0.01
+
+
+class TokenBucket:
+    """
+    Async token bucket limiting a byte rate.
+
+    Consumers may take more than the bucket holds: the balance goes negative
+    and the caller sleeps until it is paid back, so chunk size does not matter.
+    Waiters take turns and sleep for the exact deficit, there is no
+    polling. The turn goes to the waiter with the lowest `priority`, first
+    come first served among equals (see core.scheduling). A rate of None or
+    0 means unlimited.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None):
+        self._burst = burst
+        # Heap of (priority, arrival, future) waiting for the turn
+        self._waiters: List[tuple] = []
+        self._arrivals = itertools.count()
+        self._busy = False
+        self._last: Optional[tuple] = None
+        self._released_at = 0.0
+        self._rate: Optional[float] = None
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.capacity = 0.0
+        self.rate = rate
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: Optional[float]):
+        self._refill()
+        self._rate = rate or None
+        # A quarter of a second worth of data, but never less than 64 KB
+        self.capacity = self._burst or max(64 * 1024, (rate or 0) / 4)
+        self._tokens = min(self._tokens, self.capacity)
+
+    @property
+    def limited(self) -> bool:
+        return self._rate is not None
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._rate:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self._rate
+            )
+        self._updated = now
+
+    async def _acquire(self, priority: tuple):
+        if not self._busy and not self._waiters:
+            self._busy = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Handed the turn right before being cancelled: pass it on
+            if future.done() and not future.cancelled():
+                self._release(None)
+            raise
+
+    def _release(self, priority: Optional[tuple]):
+        self._last = priority
+        self._released_at = time.monotonic()
+        # Handed over on the next loop iteration, so a download coming
+        # straight back for its next chunk competes with those waiting
+        asyncio.get_running_loop().call_soon(self._hand_over)
+
+    def _hand_over(self):
+        if (
+            self._last is not None
+            and self._waiters
+            and self._waiters[0][0] > self._last
+        ):
+            delay = self._released_at + HAND_OVER_GRACE - time.monotonic()
+            if delay > 0:
+                asyncio.get_running_loop().call_later(delay, self._hand_over)
+                return
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            # Cancelled waiters are left in the heap and skipped here
+            if not future.done():
+                future.set_result(None)
+                return
+        self._busy = False
+
+    async def consume(self, amount: int, priority: tuple = ()):
+        if self._rate is None:
+            return
+        await self._acquire(priority)
+        try:
+            self._refill()
+            self._tokens -= amount
+            if self._tokens < 0 and self._rate:
+                await asyncio.sleep(-self._tokens / self._rate)
+        finally:
+            self._release(priority)
+
+
+class RateSchedule:
+    """
+    Applies a time-of-day schedule of rates to a TokenBucket.
+
+    The file has one "HH:MM RATE" entry per line, e.g. "09:00 500K" and
+    "19:00 0" (0 means unlimited). The entry with the latest time not after
+    now wins, wrapping around midnight. The file is re-read whenever it
+    changes, so limits can be edited while a run is going.
+    """
+
+    def __init__(self, path: str, bucket: TokenBucket, interval: float = 10.0):
+        self.path = path
+        self.bucket = bucket
+        self.interval = interval
+        self._mtime: Optional[float] = None
+        self._entries: List[Tuple[int, Optional[float]]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+        entries = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                at, rate = line.split()
+                hours, minutes = at.split(":")
+                entries.append((int(hours) * 60 + int(minutes), parse_rate(rate)))
+        self._entries = sorted(entries)
+        self._mtime = mtime
+
+    def current_rate(self, minute_of_day: int) -> Optional[float]:
+        rate = self._entries[-1][1] if self._entries else None
+        for start, entry_rate in self._entries:
+            if start <= minute_of_day:
+                rate = entry_rate
+        return rate
+
+    def apply(self):
+        try:
+            self._load()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read rate schedule {self.path}: {e}")
+            return
+        now = time.localtime()
+        rate = self.current_rate(now.tm_hour * 60 + now.tm_min) or None
+        if rate != self.bucket.rate:
+            logger.info(
+                f"Rate limit set to {f'{rate / 1024:.0f} KB/s' if rate else 'unlimited'}"
+            )
+            self.bucket.rate = rate
+
+    async def _run(self):
+        while True:
+            self.apply()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
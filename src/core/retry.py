@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from urllib.parse import urlparse
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Statuses worth asking again: timeouts, rate limits and transient server errors
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 600.0
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    True for errors that may go away on their own: network failures,
+    timeouts, 429 and 5xx. A 404 or a full disk is fatal.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(
+        error, (httpx.TransportError, ConnectionError, asyncio.TimeoutError)
+    )
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds asked for by the Retry-After header of a failed response."""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("Retry-After", "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return min(max(0.0, when - time.time()), MAX_RETRY_AFTER)
+
+
+class _Breaker:
+    __slots__ = ("failures", "open_until")
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+
+class RetryPolicy:
+    """
+    Retry rules shared by every request to a host.
+
+    Retryable errors are tried again after an exponential backoff with full
+    jitter (a random delay up to `base_delay * 2**attempt`), or after the
+    delay a Retry-After header asks for. Fatal errors are raised at once.
+
+    Each host has a circuit breaker: after `threshold` failures in a row, or
+    a Retry-After, every request to the host waits until `cooldown` (or the
+    asked delay) has passed. The next failure opens it again straight away,
+    and a success closes it.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        threshold: int = 5,
+        cooldown: float = 30.0,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._breakers: Dict[str, _Breaker] = {}
+
+    def _breaker(self, url: str) -> _Breaker:
+        host = urlparse(str(url)).netloc
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = _Breaker()
+        return breaker
+
+    def backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """Delay before retry number `attempt` (starting at 0)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        asked = retry_after(error) if error is not None else None
+        return delay if asked is None else max(asked, delay)
+
+    async def wait(self, url: str):
+        """Waits while the circuit breaker of the URL's host is open."""
+        breaker = self._breaker(url)
+        while True:
+            delay = breaker.open_until - time.monotonic()
+            if delay <= 0:
+                return
+            logger.debug(f"Waiting {delay:.1f}s for {urlparse(url).netloc}")
+            await asyncio.sleep(delay)
+
+    def record_success(self, url: str):
+        breaker = self._breaker(url)
+        breaker.failures = 0
+        breaker.open_until = 0.0
+
+    def record_failure(self, url: str, error: BaseException):
+        """Counts a retryable error against the host, fatal ones are ignored."""
+        if not is_retryable(error):
+            return
+        breaker = self._breaker(url)
+        breaker.failures += 1
+        pause = retry_after(error) or 0.0
+        if breaker.failures >= self.threshold:
+            pause = max(pause, self.cooldown)
+            logger.warning(
+                f"{urlparse(url).netloc} failed {breaker.failures} times in a row, "
+                f"pausing its requests for {pause:.1f}s"
+            )
+        if pause:
+            breaker.open_until = max(breaker.open_until, time.monotonic() + pause)
+
+    async def call(self, url: str, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs `func` (a request to `url`) until it succeeds, a fatal error
+        occurs or `max_retries` retries are spent.
+        """
+        attempt = 0
+        while True:
+            await self.wait(url)
+            try:
+                result = await func()
+            except Exception as e:
+                self.record_failure(url, e)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                attempt += 1
+                logger.debug(
+                    f"{e!r} on {url}, retry {attempt}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+            else:
+                self.record_success(url)
+                return result
@@ -0,0 +1,127 @@
+import asyncio
+import math
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from core.config import DOWNLOAD_ORDERS
+from utils import format_episodes, in_ranges
+
+T = TypeVar("T")
+
+ORDERS = DOWNLOAD_ORDERS
+FIFO, SEQUENTIAL, SMALLEST = ORDERS
+
+Ranges = List[Tuple[float, float]]
+
+
+class Priorities:
+    """
+    Decides which episode goes first.
+
+    fifo keeps the listing order, sequential puts the lowest episode number
+    first and smallest the episode with the fewest bytes left (unknown sizes
+    last). Boosts move episodes, by number, ahead of every unboosted one and
+    can be changed while a run is going. Lower keys go first.
+    """
+
+    def __init__(self, order: str = FIFO):
+        if order not in ORDERS:
+            raise ValueError(
+                f"Unknown order '{order}' (available: {', '.join(ORDERS)})"
+            )
+        self.order = order
+        # (ranges, value) pairs, the last one matching an episode wins
+        self._boosts: List[Tuple[Ranges, float]] = []
+
+    @property
+    def active(self) -> bool:
+        """False when episodes simply go in listing order."""
+        return self.order != FIFO or bool(self._boosts)
+
+    def boost(self, ranges: Ranges, value: float = 1.0):
+        """Raises (or with 0, resets) the priority of the episodes in `ranges`."""
+        self._boosts.append((ranges, value))
+
+    def boost_of(self, number: float) -> float:
+        for ranges, value in reversed(self._boosts):
+            if in_ranges(number, ranges):
+                return value
+        return 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "order": self.order,
+            "boosts": [
+                {"episodes": format_episodes(ranges), "boost": value}
+                for ranges, value in self._boosts
+            ],
+        }
+
+    def queue_key(self, number: float, index: int, size: Optional[int] = None) -> tuple:
+        """Key of an episode waiting to start, `index` being its listing position."""
+        boost = -self.boost_of(number)
+        if self.order == SEQUENTIAL:
+            return (boost, number, index)
+        if self.order == SMALLEST:
+            return (boost, math.inf if size is None else size, index)
+        return (boost, index)
+
+    def bandwidth_key(self, number: float, remaining: int) -> tuple:
+        """
+        Key of a running download asking for bandwidth. Running downloads
+        are equals in fifo order, so only boosts count there.
+        """
+        boost = -self.boost_of(number)
+        if self.order == SEQUENTIAL:
+            return (boost, number)
+        if self.order == SMALLEST:
+            return (boost, remaining)
+        return (boost,)
+
+
+class EpisodeQueue(Generic[T]):
+    """
+    Async queue handing out the item with the lowest key.
+
+    Keys are computed when an item is taken, not when it is put, so a boost
+    given while items wait applies to them. Once `close` is called and the
+    queue is empty, `get` returns None.
+    """
+
+    def __init__(self, key: Callable[[T], Any], maxsize: int = 0):
+        self.key = key
+        self.maxsize = maxsize
+        self._items: List[T] = []
+        self._closed = False
+        self._changed = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def put(self, item: T):
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: not self.maxsize or len(self._items) < self.maxsize
+            )
+            self._items.append(item)
+            self._changed.notify_all()
+
+    def peek(self) -> Optional[T]:
+        """The item `get` would return now, left in the queue."""
+        if not self._items:
+            return None
+        return min(self._items, key=self.key)
+
+    async def get(self) -> Optional[T]:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._items or self._closed)
+            if not self._items:
+                return None
+            best = min(range(len(self._items)), key=lambda i: self.key(self._items[i]))
+            item = self._items.pop(best)
+            self._changed.notify_all()
+            return item
+
+    async def close(self):
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from core.retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class HttpSession:
+    """
+    A single pooled HTTP client shared by platforms, players and downloaders.
+
+    Connections are kept alive between requests, the number of concurrent
+    requests per host is capped, and HTTP/2 is negotiated when `h2` is installed.
+    `retry` is the retry policy (with per-host circuit breakers) shared by
+    everything that uses the session.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 32,
+        max_keepalive: int = 16,
+        max_per_host: int = 8,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 30.0,
+        http2: bool = True,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        # More slots than pooled connections would leave requests waiting
+        # in the pool until they fail with PoolTimeout
+        self.max_per_host = min(max_per_host, max_connections)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.retry = retry or RetryPolicy()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+        # Connection reuse statistics, per host
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.connections: Dict[str, int] = defaultdict(int)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("HttpSession is not open")
+        return self._client
+
+    async def open(self):
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+            event_hooks={"request": [self._on_request]},
+        )
+
+    async def close(self):
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        self._log_stats()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _slot(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(str(url)).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_slots[host]
+
+    async def _on_request(self, request: httpx.Request):
+        host = request.url.host
+        self.requests[host] += 1
+
+        # httpcore reports every new TCP connection through the trace extension,
+        # which lets us count how many requests were served by a pooled one.
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                self.connections[host] += 1
+
+        request.extensions["trace"] = trace
+
+    def _log_stats(self):
+        for host, count in self.requests.items():
+            opened = self.connections.get(host, 0)
+            logger.debug(
+                f"{host}: {count} requests over {opened} connections "
+                f"({max(0, count - opened)} reused)"
+            )
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async with self._slot(url):
+            return await self.client.request(method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def head(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("HEAD", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        """
+        Streams a response while holding one of the host's connection slots.
+        """
+        async with self._slot(url):
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+from typing import Optional, Tuple
+
+
+class SqliteStore:
+    """
+    Base of the SQLite-backed stores (cache, journal, library, subscriptions).
+
+    Subclasses list their tables in `SCHEMA`, created on open. A store
+    created without a path is disabled: it keeps no connection and its
+    methods do nothing.
+    """
+
+    SCHEMA: Tuple[str, ...] = ()
+    PRAGMAS: Tuple[str, ...] = ("journal_mode=WAL",)
+    # File of `default()`, inside `default_dir()`
+    DEFAULT_NAME = ""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+        if path:
+            db_path = self._db_path(path)
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path)
+            for pragma in self.PRAGMAS:
+                self._db.execute(f"PRAGMA {pragma}")
+            for statement in self.SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+
+    @classmethod
+    def default(cls, **kwargs):
+        return cls(os.path.join(cls.default_dir(), cls.DEFAULT_NAME), **kwargs)
+
+    @staticmethod
+    def default_dir() -> str:
+        raise NotImplementedError
+
+    def _db_path(self, path: str) -> str:
+        return path
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
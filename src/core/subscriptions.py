@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from core.config import DEFAULT_POLL_INTERVAL
+from core.store import SqliteStore
+from utils import interleave, sanitize_filename
+
+if TYPE_CHECKING:
+    # Only for annotations, so that `watch list` does not import httpx
+    from core.base import BaseEpisode
+    from core.orchestrator import Orchestrator
+
+logger = logging.getLogger(__name__)
+
+# Each poll is moved by up to this fraction of the interval, so subscriptions
+# added together drift apart instead of polling in bursts
+POLL_JITTER = 0.1
+# Longest sleep of `watch` between checks for due subscriptions, so changes
+# made with `watch add`/`remove` are picked up
+MAX_SLEEP = 60.0
+
+_COLUMNS = (
+    "url",
+    "output",
+    "last_episode",
+    "interval",
+    "next_poll",
+    "checked_at",
+    "added_at",
+)
+
+
+def default_data_dir() -> str:
+    """
+    Returns the per-user data directory (XDG on Unix, LOCALAPPDATA on Windows).
+    Unlike the cache, it holds state that cannot be rebuilt.
+    """
+    base = os.environ.get("XDG_DATA_HOME") or os.environ.get("LOCALAPPDATA")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "anime-dl")
+
+
+def next_poll(interval: float, jitter: float = POLL_JITTER) -> float:
+    """Time of the next poll, `interval` from now give or take the jitter."""
+    return time.time() + interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+class SubscriptionStore(SqliteStore):
+    """
+    SQLite list of followed series with the highest episode already queued
+    for each. A disabled store is empty.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            url TEXT PRIMARY KEY,
+            output TEXT,
+            last_episode INTEGER,
+            interval REAL NOT NULL,
+            next_poll REAL NOT NULL,
+            checked_at REAL,
+            added_at REAL NOT NULL
+        )
+        """,
+    )
+    DEFAULT_NAME = "subscriptions.sqlite3"
+    default_dir = staticmethod(default_data_dir)
+
+    def add(
+        self,
+        url: str,
+        output: Optional[str] = None,
+        last_episode: Optional[int] = None,
+        interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        """
+        Adds or replaces a subscription. Its first poll is at a random time
+        within one interval, which staggers subscriptions added together.
+        """
+        if self._db is None:
+            return
+        now = time.time()
+        self._db.execute(
+            f"INSERT OR REPLACE INTO subscriptions ({', '.join(_COLUMNS)})"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                url,
+                output,
+                last_episode,
+                interval,
+                now + random.uniform(0, interval),
+                None,
+                now,
+            ),
+        )
+        self._db.commit()
+
+    def remove(self, url: str) -> bool:
+        if self._db is None:
+            return False
+        removed = self._db.execute(
+            "DELETE FROM subscriptions WHERE url = ?", (url,)
+        ).rowcount
+        self._db.commit()
+        return removed > 0
+
+    def update(self, url: str, **fields):
+        if self._db is None:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._db.execute(
+            f"UPDATE subscriptions SET {assignments} WHERE url = ?",
+            list(fields.values()) + [url],
+        )
+        self._db.commit()
+
+    def all(self) -> List[Dict[str, Any]]:
+        return self._select("ORDER BY url")
+
+    def due(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Subscriptions whose next poll time has passed, most overdue first."""
+        now = time.time() if now is None else now
+        return self._select("WHERE next_poll <= ? ORDER BY next_poll", (now,))
+
+    def next_due(self) -> Optional[float]:
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT MIN(next_poll) FROM subscriptions").fetchone()
+        return row[0]
+
+    def _select(self, clause: str, params=()) -> List[Dict[str, Any]]:
+        if self._db is None:
+            return []
+        rows = self._db.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM subscriptions {clause}", params
+        ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+
+class Watcher:
+    """
+    Polls subscriptions and downloads the episodes that appeared since the
+    last poll.
+
+    Listings are revalidated with conditional requests, so an unchanged
+    series costs a 304 and no parsing. Only episode numbers above the
+    subscription's last episode are queued; nothing is requested for the
+    episodes already downloaded.
+    """
+
+    def __init__(
+        self,
+        orchestrator: "Orchestrator",
+        store: SubscriptionStore,
+        output_dir: str = ".",
+        jitter: float = POLL_JITTER,
+    ):
+        self.orchestrator = orchestrator
+        self.store = store
+        self.output_dir = output_dir
+        self.jitter = jitter
+        self._semaphore = asyncio.Semaphore(orchestrator.max_resolvers)
+
+    async def poll(self, subscription: Dict[str, Any]) -> List["BaseEpisode"]:
+        """Returns the new episodes of a subscription, lowest first."""
+        url = subscription["url"]
+        async with self._semaphore:
+            episodes = await self.orchestrator.get_series_episodes(url, ttl=0)
+
+        last = subscription["last_episode"]
+        new = [ep for ep in episodes if last is None or ep.number > last]
+        self.store.update(
+            url,
+            checked_at=time.time(),
+            next_poll=next_poll(subscription["interval"], self.jitter),
+        )
+
+        folder = sanitize_filename(url.rstrip("/").split("/")[-1] or "Anime")
+        output_dir = os.path.join(self.output_dir, subscription["output"] or folder)
+        for ep in new:
+            ep.output_dir = output_dir
+            ep.name = f"{folder} {ep.name}"
+        if new:
+            logger.info(f"{len(new)} new episodes for {url}")
+        return new
+
+    async def check(
+        self, subscriptions: List[Dict[str, Any]], progress=None
+    ) -> List[bool]:
+        """
+        Polls the given subscriptions and downloads their new episodes
+        through a single pipeline. Results are in download order.
+        """
+        polls = await asyncio.gather(
+            *(self.poll(sub) for sub in subscriptions), return_exceptions=True
+        )
+        groups = []
+        for sub, new in zip(subscriptions, polls):
+            if isinstance(new, Exception):
+                logger.error(f"Failed to poll {sub['url']}: {new}")
+                continue
+            if new:
+                groups.append((sub, new))
+        if not groups:
+            return []
+
+        episodes = interleave(new for _, new in groups)
+        results = await self.orchestrator.download_episodes(episodes, progress)
+        succeeded = {id(ep) for ep, ok in zip(episodes, results) if ok}
+
+        for sub, new in groups:
+            # Stop below the first failure so it is queued again next poll
+            last = sub["last_episode"]
+            for ep in new:
+                if id(ep) not in succeeded:
+                    break
+                last = ep.number
+            if last != sub["last_episode"]:
+                self.store.update(sub["url"], last_episode=last)
+        return results
+
+    async def run(self, progress=None, once: bool = False):
+        """
+        Checks due subscriptions until cancelled. With `once`, every
+        subscription is checked a single time.
+        """
+        if once:
+            await self.check(self.store.all(), progress)
+            return
+        while True:
+            due = self.store.due()
+            if due:
+                await self.check(due, progress)
+            next_due = self.store.next_due()
+            delay = MAX_SLEEP if next_due is None else next_due - time.time()
+            await asyncio.sleep(min(max(delay, 1.0), MAX_SLEEP))
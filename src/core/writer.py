@@ -0,0 +1,139 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from core.integrity import StreamHasher
+from core.metrics import Counter
+
+# Default size of the batches handed to the writer threads
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="anime-dl-writer")
+
+
+def preallocate(fd: int, size: int):
+    """
+    Reserves `size` bytes for the file, with posix_fallocate where the OS and
+    filesystem support it (no fragmentation, early ENOSPC), else a sparse
+    truncate.
+    """
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+def _pwrite(fd: int, data, offset: int):
+    if hasattr(os, "pwrite"):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        # Windows has no pwrite. Each writer has at most one write in flight,
+        # so seeking its own descriptor is safe.
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            data = data[os.write(fd, data) :]
+
+
+def _write_batch(fd: int, data, offset: int, hasher: Optional[StreamHasher]):
+    _pwrite(fd, data, offset)
+    # Hashing here keeps it off the event loop, hashlib releases the GIL
+    if hasher is not None:
+        hasher.update(data, offset)
+
+
+class FileWriter:
+    """
+    Writes a stream of chunks at a given offset of a file without blocking
+    the event loop.
+
+    Chunks are copied into one of two reusable buffers. When a buffer is full
+    it is written by a worker thread while the other one fills up, so disk
+    stalls only slow down the download that caused them. `flushed` counts the
+    bytes that actually reached the file, which is what resume state must use.
+    Batches are also offered to `hasher`, if given, in file order, and
+    `counter`, if given, is bumped by each batch written.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        offset: int = 0,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        hasher: Optional[StreamHasher] = None,
+        counter: Optional[Counter] = None,
+    ):
+        self.fd = os.open(path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        self.offset = offset
+        self.flushed = 0
+        self.hasher = hasher
+        self.counter = counter
+        self._buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+        self._view = memoryview(self._buffers[0])
+        self._current = 0
+        self._pos = 0
+        self._pending: Optional[asyncio.Future] = None
+        self._pending_size = 0
+
+    async def write(self, chunk):
+        chunk = memoryview(chunk)
+        while chunk:
+            space = len(self._view) - self._pos
+            if len(chunk) < space:
+                self._view[self._pos : self._pos + len(chunk)] = chunk
+                self._pos += len(chunk)
+                return
+            self._view[self._pos :] = chunk[:space]
+            self._pos += space
+            chunk = chunk[space:]
+            await self._submit()
+
+    async def _wait_pending(self):
+        if self._pending is not None:
+            await self._pending
+            self.flushed += self._pending_size
+            if self.counter is not None:
+                self.counter.inc(self._pending_size)
+            self._pending = None
+
+    async def _submit(self):
+        if not self._pos:
+            return
+        # Only one write in flight per file keeps the offsets ordered
+        await self._wait_pending()
+        data = self._view[: self._pos]
+        self._pending = asyncio.get_running_loop().run_in_executor(
+            _executor,
+            _write_batch,
+            self.fd,
+            data,
+            self.offset + self.flushed,
+            self.hasher,
+        )
+        self._pending_size = self._pos
+        self._current ^= 1
+        self._view = memoryview(self._buffers[self._current])
+        self._pos = 0
+
+    async def flush(self):
+        await self._submit()
+        await self._wait_pending()
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            os.close(self.fd)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Also on errors: what was received is kept, resume state only trusts `flushed`
+        await self.close()
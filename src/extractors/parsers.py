@@ -0,0 +1,248 @@
+from abc import ABC, abstractmethod
+from html.parser import HTMLParser as _TokenizerBase
+from typing import Dict, List, Optional
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as _SelectolaxTree
+except ImportError:
+    _SelectolaxTree = None
+
+try:
+    import lxml.html as _lxml_html
+except ImportError:
+    _lxml_html = None
+
+
+class HtmlParser(ABC):
+    """
+    The few HTML queries extractors need, implemented by several backends.
+    """
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        pass
+
+    @abstractmethod
+    def links(self, html: str) -> List[str]:
+        """Returns the href of every <a> tag, in document order."""
+        pass
+
+    @abstractmethod
+    def player_iframe(
+        self, html: str, container_id: str, src_contains: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Returns the src of the first iframe inside the element with the given
+        id, or else of the first iframe whose src contains `src_contains`.
+        """
+        pass
+
+
+def _soup(html: str):
+    # bs4 is slow to import and only needed when this backend is picked
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, "html.parser")
+
+
+class SoupParser(HtmlParser):
+    """Pure-Python BeautifulSoup tree, always available."""
+
+    @property
+    def name(self) -> str:
+        return "bs4"
+
+    def links(self, html: str) -> List[str]:
+        soup = _soup(html)
+        return [a["href"] for a in soup.find_all("a", href=True)]
+
+    def player_iframe(self, html, container_id, src_contains=None):
+        soup = _soup(html)
+
+        container = soup.find(id=container_id)
+        if container:
+            iframe = container.find("iframe")
+            if iframe and iframe.get("src"):
+                return iframe["src"]
+
+        if src_contains:
+            iframe = soup.select_one(f"iframe[src*='{src_contains}']")
+            if iframe:
+                return iframe["src"]
+        return None
+
+
+class _Found(Exception):
+    pass
+
+
+class _IframeTokenizer(_TokenizerBase):
+    def __init__(self, container_id: str, src_contains: Optional[str]):
+        super().__init__(convert_charrefs=True)
+        self.container_id = container_id
+        self.src_contains = src_contains
+        # Tag name and nesting depth of the container while we are inside it
+        self.container_tag: Optional[str] = None
+        self.depth = 0
+        self.container_done = False
+        self.result: Optional[str] = None
+        self.fallback: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs: Dict[str, Optional[str]] = dict(attrs)
+
+        if self.container_tag is not None:
+            if tag == self.container_tag:
+                self.depth += 1
+            elif tag == "iframe" and not self.container_done:
+                # Only the first iframe of the container counts
+                self.container_done = True
+                if attrs.get("src"):
+                    self.result = attrs["src"]
+                    raise _Found()
+        elif attrs.get("id") == self.container_id and not self.container_done:
+            self.container_tag = tag
+            self.depth = 1
+
+        if tag == "iframe" and self.fallback is None and self.src_contains:
+            src = attrs.get("src") or ""
+            if self.src_contains in src:
+                self.fallback = src
+
+    def handle_endtag(self, tag):
+        if self.container_tag is not None and tag == self.container_tag:
+            self.depth -= 1
+            if self.depth == 0:
+                self.container_tag = None
+                self.container_done = True
+
+
+class _LinkTokenizer(_TokenizerBase):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        for key, value in attrs:
+            if key == "href" and value is not None:
+                self.hrefs.append(value)
+                return
+
+
+class StreamParser(HtmlParser):
+    """
+    Tokenizes the page without building a tree and stops at the first match.
+    """
+
+    @property
+    def name(self) -> str:
+        return "stream"
+
+    def links(self, html: str) -> List[str]:
+        tokenizer = _LinkTokenizer()
+        tokenizer.feed(html)
+        tokenizer.close()
+        return tokenizer.hrefs
+
+    def player_iframe(self, html, container_id, src_contains=None):
+        tokenizer = _IframeTokenizer(container_id, src_contains)
+        try:
+            tokenizer.feed(html)
+            tokenizer.close()
+        except _Found:
+            return tokenizer.result
+        return tokenizer.fallback
+
+
+class LxmlParser(HtmlParser):
+    """libxml2 based parser, requires `lxml`."""
+
+    @property
+    def name(self) -> str:
+        return "lxml"
+
+    def _parse(self, html: str):
+        try:
+            return _lxml_html.document_fromstring(html)
+        except ValueError:
+            # lxml refuses str input that carries an XML encoding declaration
+            return _lxml_html.document_fromstring(html.encode("utf-8"))
+
+    def links(self, html: str) -> List[str]:
+        return [str(href) for href in self._parse(html).xpath("//a/@href")]
+
+    def player_iframe(self, html, container_id, src_contains=None):
+        doc = self._parse(html)
+
+        container = doc.xpath("//*[@id=$id]", id=container_id)
+        if container:
+            iframes = container[0].xpath(".//iframe")
+            if iframes and iframes[0].get("src"):
+                return iframes[0].get("src")
+
+        if src_contains:
+            srcs = doc.xpath("//iframe[contains(@src, $s)]/@src", s=src_contains)
+            if srcs:
+                return str(srcs[0])
+        return None
+
+
+class SelectolaxParser(HtmlParser):
+    """Lexbor based parser, requires `selectolax`."""
+
+    @property
+    def name(self) -> str:
+        return "selectolax"
+
+    def links(self, html: str) -> List[str]:
+        tree = _SelectolaxTree(html)
+        return [node.attributes["href"] for node in tree.css("a[href]")]
+
+    def player_iframe(self, html, container_id, src_contains=None):
+        tree = _SelectolaxTree(html)
+
+        container = tree.css_first(f"[id='{container_id}']")
+        if container:
+            iframe = container.css_first("iframe")
+            if iframe and iframe.attributes.get("src"):
+                return iframe.attributes["src"]
+
+        if src_contains:
+            iframe = tree.css_first(f"iframe[src*='{src_contains}']")
+            if iframe:
+                return iframe.attributes["src"]
+        return None
+
+
+PARSERS = {
+    "selectolax": SelectolaxParser,
+    "lxml": LxmlParser,
+    "stream": StreamParser,
+    "bs4": SoupParser,
+}
+
+
+def available_parsers() -> List[str]:
+    names = ["stream", "bs4"]
+    if _lxml_html is not None:
+        names.insert(0, "lxml")
+    if _SelectolaxTree is not None:
+        names.insert(0, "selectolax")
+    return names
+
+
+def get_parser(name: str = "auto") -> HtmlParser:
+    """
+    Returns the requested backend, or the fastest installed one for "auto".
+    """
+    available = available_parsers()
+    if name == "auto":
+        name = available[0]
+    if name not in available:
+        raise ValueError(
+            f"HTML parser '{name}' is not available (installed: {', '.join(available)})"
+        )
+    return PARSERS[name]()
@@ -1,58 +1,75 @@
-import httpx
+import asyncio
+import html as html_lib
 import logging
-from typing import List, Optional, Set, Tuple
-from bs4 import BeautifulSoup
+import re
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, quote, urljoin, urlparse
 from core.base import Platform, BaseEpisode
+from core.cache import CacheStore, EPISODES_TTL, PLAYER_URL_TTL
 from core.config import SupportedPlayers
+from core.metrics import host_of, metrics
+from core.session import HttpSession
+from extractors.parsers import HtmlParser, get_parser
+from extractors.players.registry import load_players, player_for_label, player_label
 
 logger = logging.getLogger(__name__)
 
+# Mirrors are listed in a host select, each option leading to the episode
+# page that shows that host's player (`?host=LECTEUR X`)
+_HOST_SELECT_RE = re.compile(
+    r"""<select\b[^>]*class=["'][^"']*\bhost-select\b[^>]*>(.*?)</select>""",
+    re.I | re.S,
+)
+_REDIRECT_RE = re.compile(r"""<option\b[^>]*data-redirect=["']([^"']+)["']""", re.I)
+# Pagination links of long listings: rel="next" or a "next" class
+_TAG_RE = re.compile(r"<(?:a|link)\b[^>]*>", re.I)
+_NEXT_RE = re.compile(r"""rel=["']next["']|class=["'][^"']*\bnext\b""", re.I)
+_HREF_RE = re.compile(r"""href=["']([^"']+)["']""", re.I)
+
+
+def format_episode_url(url: str, player_code: str) -> str:
+    """
+    Adds the host parameter that makes the episode page show the given player.
+    """
+    label = player_label(player_code)
+    if not label:
+        return url
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}host={quote('LECTEUR ' + label)}"
+
 
 class VoirAnimeEpisode(BaseEpisode):
-    def __init__(self, number: int, name: str, url: str, player_code: str):
-        super().__init__(number, name, url)
+    def __init__(
+        self,
+        number: int,
+        name: str,
+        url: str,
+        player_code: str,
+        session: HttpSession,
+        cache: Optional[CacheStore] = None,
+        parser: Optional[HtmlParser] = None,
+    ):
+        super().__init__(number, name, url, session, cache)
         self.player_code = player_code
+        self.parser = parser or get_parser()
 
     async def get_player_url(self) -> Optional[str]:
         """
         Scrapes the VoirAnime episode page to find the iframe URL for the selected player.
         """
         try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            async with httpx.AsyncClient(
-                headers=headers, follow_redirects=True
-            ) as client:
-                resp = await client.get(self.url)
-                resp.raise_for_status()
-                html = resp.text
-
-            soup = BeautifulSoup(html, "html.parser")
-
-            # Strategy 1: Look for id="chapter-video-frame"
-            # This is usually the main container for the active player (selected by host param)
-            container = soup.find(id="chapter-video-frame")
-            if container:
-                iframe = container.find("iframe")
-                if iframe and iframe.get("src"):
-                    return iframe["src"]
-
-            # Strategy 2: Fallback based on player code if the main container strategy fails
-            # or if the host param didn't work as expected
-            if self.player_code == SupportedPlayers.STREAMTAPE:
-                iframe = soup.select_one("iframe[src*='streamtape']")
-                if iframe:
-                    return iframe["src"]
-
-            # Future players fallback
-            # elif self.player_code == SupportedPlayers.VIDMOLY:
-            #     ...
-
-            logger.warning(
-                f"Could not find player iframe for episode {self.number} (player: {self.player_code})"
+            player_url = await self.cache.fetch(
+                self.session,
+                "player_url",
+                self.url,
+                self._parse_player_url,
+                PLAYER_URL_TTL,
             )
-            return None
+            if not player_url:
+                logger.warning(
+                    f"Could not find player iframe for episode {self.number} (player: {self.player_code})"
+                )
+            return player_url
 
         except Exception as e:
             logger.error(
@@ -61,67 +78,212 @@ class VoirAnimeEpisode(BaseEpisode):
             )
             return None
 
+    async def get_mirror_urls(self) -> List[str]:
+        """
+        Returns the player URL of every mirror on the episode page, with the
+        selected player first.
+
+        The page only embeds the selected player, so the page of each other
+        host with a registered player is fetched (through the page cache) for
+        its iframe.
+        """
+        try:
+            page = await self.cache.fetch(
+                self.session,
+                "mirror_hosts",
+                self.url,
+                self._parse_mirrors,
+                PLAYER_URL_TTL,
+            )
+        except Exception as e:
+            logger.error(
+                f"Error extracting mirrors for episode {self.number}: {e}",
+                exc_info=True,
+            )
+            return []
+        if not page:
+            return []
+
+        mirrors = [page["player"]] if page["player"] else []
+        hosts = [url for url in page["hosts"] if url != self.url]
+        for url in await asyncio.gather(*(self._host_player_url(u) for u in hosts)):
+            if url and url not in mirrors:
+                mirrors.append(url)
+        return mirrors
+
+    async def _host_player_url(self, host_url: str) -> Optional[str]:
+        try:
+            return await self.cache.fetch(
+                self.session,
+                "player_url",
+                host_url,
+                self._parse_player_url,
+                PLAYER_URL_TTL,
+            )
+        except Exception as e:
+            logger.warning(f"Could not fetch mirror page {host_url}: {e}")
+            return None
+
+    def _parse_mirrors(self, html: str) -> Optional[Dict]:
+        """
+        The selected player's URL and the page URLs of the other hosts a
+        registered player can handle.
+        """
+        player_url = self._parse_player_url(html)
+        hosts: List[str] = []
+        select = _HOST_SELECT_RE.search(html)
+        for url in _REDIRECT_RE.findall(select.group(1) if select else ""):
+            url = urljoin(self.url, html_lib.unescape(url))
+            label = parse_qs(urlparse(url).query).get("host", [""])[0]
+            if player_for_label(label) is not None and url not in hosts:
+                hosts.append(url)
+        if not player_url and not hosts:
+            return None
+        return {"player": player_url, "hosts": hosts}
+
+    def _parse_player_url(self, html: str) -> Optional[str]:
+        # Strategy 1: Look for id="chapter-video-frame"
+        # This is usually the main container for the active player (selected by host param)
+        # Strategy 2: Fallback based on player code if the main container strategy fails
+        # or if the host param didn't work as expected
+        player = load_players().get(self.player_code)
+        src_contains = player.hosts[0] if player and player.hosts else None
+
+        # The backends agree with bs4 (see benchmarks/bench_parsers.py), so a
+        # miss means the page has no player and is not parsed again
+        return self.parser.player_iframe(html, "chapter-video-frame", src_contains)
+
 
 class VoirAnimePlatform(Platform):
-    def __init__(self, preferred_player: str = SupportedPlayers.STREAMTAPE):
+    def __init__(
+        self,
+        session: HttpSession,
+        preferred_player: str = SupportedPlayers.STREAMTAPE,
+        cache: Optional[CacheStore] = None,
+        parser: Optional[HtmlParser] = None,
+    ):
+        super().__init__(session, cache)
         self.preferred_player = preferred_player
+        self.parser = parser or get_parser()
 
     @property
     def name(self) -> str:
         return "VoirAnime"
 
-    async def get_episodes(self, series_url: str) -> List[BaseEpisode]:
+    async def get_episodes(
+        self, series_url: str, ttl: Optional[float] = None
+    ) -> List[BaseEpisode]:
         """
         Parses the VoirAnime series page and returns a list of episodes.
         """
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            async with httpx.AsyncClient(
-                headers=headers, follow_redirects=True
-            ) as client:
-                resp = await client.get(series_url)
-                resp.raise_for_status()
-                html = resp.text
-
-            soup = BeautifulSoup(html, "html.parser")
-
-            if series_url.endswith("/"):
-                series_url = series_url[:-1]
-
-            episodes_data: List[Tuple[int, str]] = []
-            seen_urls: Set[str] = set()
-
-            for a in soup.find_all("a", href=True):
-                url = a["href"]
-                # Basic validation to ensure it belongs to the same series structure
-                if not url.startswith(series_url) or url in seen_urls:
-                    continue
+        episodes = [episode async for episode in self.iter_episodes(series_url, ttl)]
+        episodes.sort(key=lambda ep: ep.number)
+        return episodes
 
-                num = self._extract_episode_number(url)
-                if num is not None:
-                    full_url = self._format_url(url)
-                    episodes_data.append((num, full_url))
-                    seen_urls.add(url)
+    def episode_from_url(self, url: str) -> BaseEpisode:
+        """
+        Builds an episode from its page URL, the number is taken from the URL.
+        """
+        number = self._extract_episode_number(url) or 0
+        return VoirAnimeEpisode(
+            number=number,
+            name=f"Episode {number}",
+            # The host parameter makes the page show the preferred player
+            url=self._format_url(url),
+            player_code=self.preferred_player,
+            session=self.session,
+            cache=self.cache,
+            parser=self.parser,
+        )
 
-            episodes_data.sort(key=lambda x: x[0])
+    async def iter_episodes(
+        self, series_url: str, ttl: Optional[float] = None
+    ) -> AsyncIterator[BaseEpisode]:
+        """
+        Yields the episodes of each listing page as soon as it is parsed, then
+        follows the page's "next" link, if any. Episodes already seen on an
+        earlier page are skipped. With `ttl=0` every cached page is
+        revalidated with a conditional request.
+        """
+        page_url: Optional[str] = series_url
+        visited: Set[str] = set()
+        # Only episode numbers are kept, so memory does not grow with pages
+        seen: Set[int] = set()
+        while page_url and page_url not in visited:
+            visited.add(page_url)
+            try:
+                with metrics.timer(
+                    "stage_seconds", stage="get_episodes", host=host_of(page_url)
+                ) as timing:
+                    page = await self.cache.fetch(
+                        self.session,
+                        "episode_page",
+                        page_url,
+                        lambda html: self._parse_episode_page(html, series_url),
+                        EPISODES_TTL if ttl is None else ttl,
+                    )
+                    if not page:
+                        timing.outcome = "empty"
+            except Exception as e:
+                logger.error(
+                    f"Error fetching episodes from {page_url}: {e}", exc_info=True
+                )
+                return
+            if not page:
+                return
 
-            return [
-                VoirAnimeEpisode(
+            for num, url in page["episodes"]:
+                if num in seen:
+                    continue
+                seen.add(num)
+                yield VoirAnimeEpisode(
                     number=num,
                     name=f"Episode {num}",
-                    url=url,
+                    url=self._format_url(url),
                     player_code=self.preferred_player,
+                    session=self.session,
+                    cache=self.cache,
+                    parser=self.parser,
                 )
-                for num, url in episodes_data
-            ]
+            page_url = page["next"] and urljoin(page_url, page["next"])
 
-        except Exception as e:
-            logger.error(
-                f"Error fetching episodes from {series_url}: {e}", exc_info=True
-            )
-            return []
+    def _parse_episode_page(self, html: str, series_url: str) -> Optional[Dict]:
+        episodes = self._parse_episodes(html, series_url)
+        if not episodes:
+            return None
+        return {"episodes": episodes, "next": self._parse_next_page(html)}
+
+    def _parse_next_page(self, html: str) -> Optional[str]:
+        for tag in _TAG_RE.findall(html):
+            if _NEXT_RE.search(tag):
+                href = _HREF_RE.search(tag)
+                if href:
+                    return href.group(1)
+        return None
+
+    def _parse_episodes(self, html: str, series_url: str) -> List[Tuple[int, str]]:
+        """
+        Returns the (number, url) pairs of every episode linked from the page,
+        sorted by episode number.
+        """
+        if series_url.endswith("/"):
+            series_url = series_url[:-1]
+
+        episodes_data: List[Tuple[int, str]] = []
+        seen_urls: Set[str] = set()
+
+        for url in self.parser.links(html):
+            # Basic validation to ensure it belongs to the same series structure
+            if not url.startswith(series_url) or url in seen_urls:
+                continue
+
+            num = self._extract_episode_number(url)
+            if num is not None:
+                episodes_data.append((num, url))
+                seen_urls.add(url)
+
+        episodes_data.sort(key=lambda x: x[0])
+        return episodes_data
 
     def _extract_episode_number(self, url: str) -> Optional[int]:
         clean_url = url.rstrip("/")
@@ -135,14 +297,4 @@ class VoirAnimePlatform(Platform):
         """
         Formats the URL with the correct host parameter for the selected player.
         """
-        host_param = ""
-        if self.preferred_player == SupportedPlayers.STREAMTAPE:
-            host_param = "host=LECTEUR%20Stape"
-        # elif self.preferred_player == SupportedPlayers.VIDMOLY:
-        #     host_param = "host=..."
-
-        if not host_param:
-            return url
-
-        separator = "&" if "?" in url else "?"
-        return f"{url}{separator}{host_param}"
+        return format_episode_url(url, self.preferred_player)
@@ -0,0 +1,53 @@
+from typing import Dict, List, Optional, Type
+
+from core.base import VideoPlayer
+from extractors.players.streamtape import StreamtapePlayer
+from utils import load_entry_points
+
+# Entry point group third-party packages use to add players, e.g. in their
+# pyproject.toml: [project.entry-points."anime_dl.players"] vidmoly = "pkg:VidmolyPlayer"
+ENTRY_POINT_GROUP = "anime_dl.players"
+
+PLAYERS: Dict[str, Type[VideoPlayer]] = {
+    StreamtapePlayer.code: StreamtapePlayer,
+}
+
+
+def register_player(player: Type[VideoPlayer]) -> Type[VideoPlayer]:
+    """Adds a player to the registry. Usable as a class decorator."""
+    PLAYERS[player.code] = player
+    return player
+
+
+def load_players() -> Dict[str, Type[VideoPlayer]]:
+    """
+    Returns the built-in players plus those installed through entry points.
+    A plugin that fails to load is skipped with a warning.
+    """
+    for name, player in load_entry_points(ENTRY_POINT_GROUP, VideoPlayer):
+        PLAYERS.setdefault(player.code or name, player)
+    return PLAYERS
+
+
+def available_players() -> List[str]:
+    return list(load_players())
+
+
+def player_label(code: str) -> Optional[str]:
+    """The name mirror lists give a player, e.g. "Stape" for Streamtape."""
+    player = load_players().get(code)
+    return player.labels[0] if player and player.labels else None
+
+
+def player_for_label(label: str) -> Optional[Type[VideoPlayer]]:
+    """The player a mirror list means by `label`, e.g. "LECTEUR Stape"."""
+    words = label.split()
+    if words and words[0].upper() == "LECTEUR":
+        words = words[1:]
+    if not words:
+        return None
+    name = words[0].lower()
+    for player in load_players().values():
+        if any(name == known.lower() for known in player.labels):
+            return player
+    return None
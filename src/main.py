@@ -1,4 +1,3 @@
-import asyncio
 import sys
 from cli import AnimeDL
 
@@ -6,7 +5,14 @@ from cli import AnimeDL
 def main():
     try:
         app = AnimeDL()
-        asyncio.run(app.run())
+        # --help, argument errors and commands without downloads return
+        # before asyncio (and ssl) is imported
+        parsed = app.parse_args()
+        if parsed is None:
+            return
+        import asyncio
+
+        asyncio.run(app.run(parsed))
     except KeyboardInterrupt:
         sys.exit(0)
 
@@ -1,5 +1,151 @@
+import functools
+import logging
+import re
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    List,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
 def sanitize_filename(name: str):
     """
     Sanitize the filename by removing illegal characters.
     """
     return "".join([c if c.isalnum() else " " for c in name]).strip().capitalize()
+
+
+def interleave(groups: Iterable[List[T]]) -> List[T]:
+    """
+    Merges lists round-robin: [[a1, a2], [b1]] -> [a1, b1, a2].
+    """
+    groups = [list(g) for g in groups]
+    merged = []
+    for i in range(max((len(g) for g in groups), default=0)):
+        merged.extend(g[i] for g in groups if i < len(g))
+    return merged
+
+
+async def aiterate(items: Union[Iterable[T], AsyncIterable[T]]) -> AsyncIterator[T]:
+    """
+    Iterates a plain or an async iterable from async code.
+    """
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(value: str) -> int:
+    """
+    Parses a byte size such as "512K", "4M" or "1.5MB".
+    """
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?)(?:i?B)?\s*", value, re.I)
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_rate(value: str) -> float:
+    """
+    Parses a byte rate such as "800K", "2M" or "1.5MB/s" into bytes per second.
+    """
+    value = value.strip()
+    if value.lower().endswith("/s"):
+        value = value[:-2]
+    return float(parse_size(value))
+
+
+_DURATION_UNITS = {"": 1, "S": 1, "M": 60, "H": 3600, "D": 86400}
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parses a duration such as "90", "30m", "6h" or "1.5d" into seconds.
+    """
+    match = re.fullmatch(r"\s*([\d.]+)\s*([SMHD]?)\s*", value, re.I)
+    if not match:
+        raise ValueError(f"Invalid duration: {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2).upper()]
+
+
+def parse_episodes(value: str) -> List[Tuple[float, float]]:
+    """
+    Parses an episode selection such as "3-7,12" or "20-" (open-ended) into
+    inclusive (first, last) ranges.
+    """
+    ranges = []
+    for part in value.split(","):
+        match = re.fullmatch(r"\s*(\d+)\s*(?:(-)\s*(\d*))?\s*", part)
+        if not match:
+            raise ValueError(f"Invalid episode selection: {value!r}")
+        first = int(match.group(1))
+        if not match.group(2):
+            last = first
+        else:
+            last = int(match.group(3)) if match.group(3) else float("inf")
+        if last < first:
+            raise ValueError(f"Invalid episode range: {part.strip()!r}")
+        ranges.append((first, last))
+    return ranges
+
+
+def in_ranges(number: float, ranges: List[Tuple[float, float]]) -> bool:
+    return any(first <= number <= last for first, last in ranges)
+
+
+def format_episodes(ranges: List[Tuple[float, float]]) -> str:
+    """Inverse of `parse_episodes`."""
+    parts = []
+    for first, last in ranges:
+        if first == last:
+            parts.append(f"{first:g}")
+        else:
+            parts.append(f"{first:g}-{'' if last == float('inf') else f'{last:g}'}")
+    return ",".join(parts)
+
+
+@functools.lru_cache(maxsize=None)
+def load_entry_points(group: str, kind: type = object) -> List[Tuple[str, Any]]:
+    """
+    (name, object) pairs installed by other packages under an entry point
+    group, loaded once. An entry point that fails to load, or is not a
+    subclass of `kind` when one is given, is skipped with a warning.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    points = entry_points()
+    if hasattr(points, "select"):
+        points = points.select(group=group)
+    else:
+        points = points.get(group, [])
+    loaded = []
+    for point in points:
+        try:
+            plugin = point.load()
+        except Exception as e:
+            logger.warning(f"Could not load plugin '{point.name}' ({group}): {e}")
+            continue
+        if kind is not object and not (
+            isinstance(plugin, type) and issubclass(plugin, kind)
+        ):
+            logger.warning(f"Plugin '{point.name}' ({group}) is not a {kind.__name__}")
+            continue
+        loaded.append((point.name, plugin))
+    return loaded